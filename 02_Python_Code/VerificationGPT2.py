@@ -4,22 +4,41 @@ import serial
 import time
 from typing import Optional, Tuple
 from transformers import GPT2Tokenizer, GPT2LMHeadModel
+from transformers.cache_utils import Cache
 from transformers.models.gpt2.modeling_gpt2 import GPT2Attention
-from softmax_batch import open_serial, close_serial, softmax_batch
-
+from softmax_batch import open_serial, close_serial
+from softmax_cache import SoftmaxCache
+from santa_device import AsyncSantaDevice
+from softmax_backend import SoftmaxBackend, as_backend
+from santa_trace import Tracer, span
 
 SERIAL_PORT = "COM3"
 BAUD_RATE = 115200
+CACHE_PATH = "softmax_cache.npz"
 
 
 class GPT2AttentionSoftmaxApprox(GPT2Attention):
 
     def __init__(self, config, is_cross_attention=False, layer_idx=None):
         super().__init__(config, is_cross_attention, layer_idx)
-        self.ser = None
+        self.backend: Optional[SoftmaxBackend] = None
+        self.cache: Optional[SoftmaxCache] = None
+        self.tracer: Optional[Tracer] = None
+
+    def set_backend(self, backend):
+        self.backend = as_backend(backend)
 
     def set_serial(self, ser):
-        self.ser = ser
+        self.set_backend(ser)
+
+    def set_cache(self, cache: Optional[SoftmaxCache]):
+        self.cache = cache
+
+    def set_device(self, device: Optional[AsyncSantaDevice]):
+        self.set_backend(device)
+
+    def set_tracer(self, tracer: Optional[Tracer]):
+        self.tracer = tracer
 
     def _my_split_heads(self, tensor, num_heads, attn_head_size):
         new_shape = tensor.size()[:-1] + (num_heads, attn_head_size)
@@ -35,6 +54,8 @@ class GPT2AttentionSoftmaxApprox(GPT2Attention):
         self,
         hidden_states: Optional[Tuple[torch.FloatTensor]],
         layer_past: Optional[Tuple[torch.Tensor]] = None,
+        past_key_value: Optional[Cache] = None,
+        cache_position: Optional[torch.LongTensor] = None,
         attention_mask: Optional[torch.FloatTensor] = None,
         head_mask: Optional[torch.FloatTensor] = None,
         encoder_hidden_states: Optional[torch.Tensor] = None,
@@ -44,69 +65,95 @@ class GPT2AttentionSoftmaxApprox(GPT2Attention):
         **kwargs,
     ) -> Tuple[torch.Tensor, Optional[torch.Tensor], Optional[Tuple[torch.Tensor]]]:
 
-        if self.ser is None:
-            raise RuntimeError("UART serial is not set. Call set_serial(ser).")
+        if self.backend is None:
+            raise RuntimeError("Softmax backend is not set. Call set_backend().")
 
-        query, key, value = self.c_attn(hidden_states).split(self.split_size, dim=2)
+        with span(self.tracer, "Q/K/V projection"):
+            qkv = self.c_attn(hidden_states)
+            query, key, value = qkv.split(self.split_size, dim=2)
 
-        query = self._my_split_heads(query, self.num_heads, self.head_dim)
-        key = self._my_split_heads(key, self.num_heads, self.head_dim)
-        value = self._my_split_heads(value, self.num_heads, self.head_dim)
+            query = self._my_split_heads(query, self.num_heads, self.head_dim)
+            key = self._my_split_heads(key, self.num_heads, self.head_dim)
+            value = self._my_split_heads(value, self.num_heads, self.head_dim)
 
-        attn_weights = torch.matmul(query, key.transpose(-1, -2))
-
-        if self.scale_attn_weights:
-            attn_weights = attn_weights / (value.size(-1) ** 0.5)
-
-        query_length, key_length = query.size(-2), key.size(-2)
-        causal_mask = self.bias[
-            :, :, key_length - query_length : key_length, :key_length
-        ]
-
-        mask_value = torch.finfo(attn_weights.dtype).min
-        attn_weights = torch.where(
-            causal_mask.bool(),
-            attn_weights,
-            torch.tensor(mask_value).to(attn_weights.device),
-        )
+        # Past keys/values come either from a transformers Cache (updated in
+        # place) or from a legacy (key, value) tuple; only the new query rows
+        # are scored and sent.
+        if past_key_value is not None:
+            key, value = past_key_value.update(
+                key, value, self.layer_idx, {"cache_position": cache_position}
+            )
+        elif layer_past is not None:
+            past_key, past_value = layer_past
+            key = torch.cat((past_key, key), dim=-2)
+            value = torch.cat((past_value, value), dim=-2)
+
+        with span(self.tracer, "score matmul"):
+            attn_weights = torch.matmul(query, key.transpose(-1, -2))
+
+            if self.scale_attn_weights:
+                attn_weights = attn_weights / (value.size(-1) ** 0.5)
+
+            query_length, key_length = query.size(-2), key.size(-2)
+            causal_mask = self.bias[
+                :, :, key_length - query_length : key_length, :key_length
+            ]
+
+            mask_value = torch.finfo(attn_weights.dtype).min
+            attn_weights = torch.where(
+                causal_mask.bool(),
+                attn_weights,
+                torch.tensor(mask_value).to(attn_weights.device),
+            )
 
-        if attention_mask is not None:
-            attn_weights = attn_weights + attention_mask
+            if attention_mask is not None:
+                attn_weights = attn_weights + attention_mask[:, :, :, :key_length]
 
         B, H, Tq, Tk = attn_weights.shape
-        attn_weights_cpu = attn_weights.detach().cpu().numpy()
-
-        attn_probs = torch.zeros_like(attn_weights)
-
-        for b in range(B):
-            for h in range(H):
-                matrix = attn_weights_cpu[b, h]
-                rows_list = [matrix[i, :] for i in range(Tq)]
-
-                probs_list = softmax_batch(
-                    self.ser, rows_list, pad_value=-32.0, timeout_s=5.0
-                )
 
-                probs_matrix = np.vstack(probs_list)
-                attn_probs[b, h] = torch.tensor(
-                    probs_matrix, dtype=attn_weights.dtype, device=attn_weights.device
+        # Query row i only sees keys [0, Tk - Tq + i]; send it at that length
+        # so early rows go out in the short modes, the tail comes back as 0.
+        causal_lengths = np.arange(Tk - Tq + 1, Tk + 1)
+
+        if hasattr(self.backend, "softmax_tensor"):
+            # Tensor backends (fp32, q610) take all heads in one call.
+            with span(self.tracer, "softmax", rows=B * H * Tq):
+                attn_probs = self.backend.softmax_tensor(
+                    attn_weights, torch.from_numpy(causal_lengths)
+                ).to(attn_weights.dtype)
+        else:
+            # Every (b, h) query row goes out in a single varlen dispatch so
+            # short causal rows from different heads share 16x4 / 32x2 frames.
+            rows = attn_weights.detach().cpu().numpy().reshape(B * H * Tq, Tk)
+            row_lengths = np.tile(causal_lengths, B * H)
+            with span(self.tracer, "softmax", rows=len(rows)):
+                probs = self.backend.softmax(
+                    rows, row_lengths, cache=self.cache, stats=self.tracer
                 )
+            attn_probs = torch.from_numpy(probs.reshape(B, H, Tq, Tk)).to(
+                dtype=attn_weights.dtype, device=attn_weights.device
+            )
 
         attn_probs = self.attn_dropout(attn_probs)
 
-        attn_output = torch.matmul(attn_probs, value)
-
-        attn_output = self._my_merge_heads(attn_output, self.num_heads, self.head_dim)
+        with span(self.tracer, "P@V"):
+            attn_output = torch.matmul(attn_probs, value)
 
-        attn_output = self.c_proj(attn_output)
-        attn_output = self.resid_dropout(attn_output)
+        with span(self.tracer, "output projection"):
+            attn_output = self._my_merge_heads(
+                attn_output, self.num_heads, self.head_dim
+            )
+            attn_output = self.c_proj(attn_output)
+            attn_output = self.resid_dropout(attn_output)
 
-        present = (key, value) if use_cache else None
+        present = (key, value) if use_cache and past_key_value is None else None
 
         return attn_output, present
 
 
-def replace_gpt2_attention(model: GPT2LMHeadModel, ser_instance):
+def replace_gpt2_attention(
+    model: GPT2LMHeadModel, ser_instance, cache: Optional[SoftmaxCache] = None
+):
     count = 0
     for i, layer in enumerate(model.transformer.h):
         old_attn = layer.attn
@@ -116,14 +163,16 @@ def replace_gpt2_attention(model: GPT2LMHeadModel, ser_instance):
             layer_idx=old_attn.layer_idx,
         )
         new_attn.load_state_dict(old_attn.state_dict(), strict=True)
+        new_attn.train(old_attn.training)
         new_attn.set_serial(ser_instance)
+        new_attn.set_cache(cache)
 
         layer.attn = new_attn
         count += 1
     print(f"Replaced {count} attention layers with Hardware-Approximated version.")
 
 
-def build_model_GPT2(ser: serial.Serial):
+def build_model_GPT2(ser: serial.Serial, cache: Optional[SoftmaxCache] = None):
     device = "cpu"
     model_name = "gpt2"
 
@@ -133,12 +182,13 @@ def build_model_GPT2(ser: serial.Serial):
 
     base_model = GPT2LMHeadModel.from_pretrained(model_name).to(device).eval()
     approx_model = GPT2LMHeadModel.from_pretrained(model_name).to(device).eval()
-    replace_gpt2_attention(approx_model, ser)
+    replace_gpt2_attention(approx_model, ser, cache)
     return tokenizer, base_model, approx_model, device
 
 
 def run_interactive_verification():
     ser = open_serial(SERIAL_PORT, baud=BAUD_RATE, timeout=1.0)
+    cache = SoftmaxCache(path=CACHE_PATH)
     device = "cpu"
     model_name = "gpt2"
 
@@ -148,7 +198,7 @@ def run_interactive_verification():
 
     baseline_model = GPT2LMHeadModel.from_pretrained(model_name).to(device).eval()
     approx_model = GPT2LMHeadModel.from_pretrained(model_name).to(device).eval()
-    replace_gpt2_attention(approx_model, ser)
+    replace_gpt2_attention(approx_model, ser, cache)
 
     while True:
         try:
@@ -170,7 +220,7 @@ def run_interactive_verification():
                 num_return_sequences=1,
                 do_sample=False,
                 pad_token_id=tokenizer.eos_token_id,
-                use_cache=False,
+                use_cache=True,
             )
             base_time = time.time() - start_t
             text_base = tokenizer.decode(out_base[0], skip_special_tokens=True)
@@ -185,11 +235,16 @@ def run_interactive_verification():
                     num_return_sequences=1,
                     do_sample=False,
                     pad_token_id=tokenizer.eos_token_id,
-                    use_cache=False,
+                    use_cache=True,
                 )
                 approx_time = time.time() - start_t
                 text_approx = tokenizer.decode(out_approx[0], skip_special_tokens=True)
                 print(f"[Approx]  : {text_approx} ({approx_time:.2f}s)")
+                st = cache.stats()
+                print(
+                    f"[Cache]   : hits={st['hits']} misses={st['misses']} "
+                    f"hit_rate={st['hit_rate']:.1%} entries={st['entries']}"
+                )
             except Exception as e:
                 print(f"[Approx]  : Error -> {e}")
                 text_approx = "ERROR"
@@ -199,6 +254,7 @@ def run_interactive_verification():
             break
         except Exception as e:
             print(f"\nAn error occurred: {e}")
+    cache.save()
     close_serial(ser)
     print("Serial port closed.")
 
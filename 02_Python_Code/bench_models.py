@@ -0,0 +1,250 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import torch
+from softmax_batch import open_serial, close_serial, EMULATOR_PORT
+from VerificationBERT import build_model_BERT
+from VerificationGPT2 import build_model_GPT2
+
+# End-to-end throughput: sentences/s for the SST-2 BERT classifier and
+# generated tokens/s for GPT-2, per input-length bucket and per backend:
+#   fp32      the unmodified PyTorch model
+#   emulator  the approximate model on the Q6.10 software model of the core
+#   board     the approximate model on a SANTA board (--port)
+#
+#   python bench_models.py --backends fp32 emulator --out models.json
+#   python bench_models.py --backends board --port COM3 --per-bucket 50
+
+BUCKETS = [(1, 16), (17, 32), (33, 64), (65, 128), (129, 768)]
+MAX_KEYS = 768
+BACKENDS = ("fp32", "emulator", "board")
+
+
+def bucket_name(lo: int, hi: int) -> str:
+    return f"{lo}-{hi}"
+
+
+def reset_peak_rss() -> bool:
+    # On Linux, writing 5 to clear_refs restarts the VmHWM high-water mark,
+    # so each bucket reports its own peak. Returns False where that is not
+    # possible and the peak stays process-wide.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss_mb() -> float | None:
+    # VmHWM since the last reset_peak_rss(); elsewhere the process-wide
+    # high-water mark, which only grows. Not available on Windows.
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def attach_serial(model, ser) -> None:
+    for module in model.modules():
+        if hasattr(module, "set_serial"):
+            module.set_serial(ser)
+
+
+def bucketize(
+    tokenizer, texts: list[str], per_bucket: int, max_length: int = MAX_KEYS
+) -> dict:
+    # Buckets past max_length (or the model's limit) are clipped to it, and
+    # so are the texts.
+    max_length = min(max_length, tokenizer.model_max_length)
+    ids = tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+    lengths = [len(x) for x in ids]
+    out = {}
+    for lo, hi in BUCKETS:
+        hi = min(hi, max_length)
+        picked = [t for t, n in zip(texts, lengths) if lo <= n <= hi]
+        if lo <= hi and picked:
+            out[bucket_name(lo, hi)] = picked[:per_bucket]
+    return out
+
+
+def bench_bert(tokenizer, model, buckets: dict, batch_size: int) -> list[dict]:
+    rows = []
+    for name, texts in buckets.items():
+        batches = [
+            tokenizer(
+                texts[i : i + batch_size],
+                return_tensors="pt",
+                truncation=True,
+                padding=True,
+            )
+            for i in range(0, len(texts), batch_size)
+        ]
+        per_bucket = reset_peak_rss()
+        with torch.no_grad():
+            model(**batches[0])
+            t0 = time.perf_counter()
+            for inputs in batches:
+                model(**inputs)
+            dt = time.perf_counter() - t0
+        tokens = sum(int(b["attention_mask"].sum()) for b in batches)
+        rows.append(
+            {
+                "bucket": name,
+                "sentences": len(texts),
+                "mean_tokens": tokens / len(texts),
+                "seconds": dt,
+                "sentences_per_s": len(texts) / dt,
+                "peak_rss_mb": peak_rss_mb(),
+                "peak_rss_per_bucket": per_bucket,
+            }
+        )
+    return rows
+
+
+def bench_gpt2(tokenizer, model, buckets: dict, new_tokens: int) -> list[dict]:
+    rows = []
+    for name, texts in buckets.items():
+        # Generated tokens are keys too, and the core takes at most MAX_KEYS.
+        prompts = [
+            tokenizer(
+                t,
+                return_tensors="pt",
+                truncation=True,
+                max_length=MAX_KEYS - new_tokens,
+            )
+            for t in texts
+        ]
+        kwargs = dict(
+            max_new_tokens=new_tokens,
+            min_new_tokens=new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.eos_token_id,
+            use_cache=True,
+        )
+        per_bucket = reset_peak_rss()
+        with torch.no_grad():
+            model.generate(**prompts[0], **kwargs)
+            t0 = time.perf_counter()
+            generated = 0
+            for p in prompts:
+                out = model.generate(**p, **kwargs)
+                generated += out.shape[-1] - p["input_ids"].shape[-1]
+            dt = time.perf_counter() - t0
+        rows.append(
+            {
+                "bucket": name,
+                "prompts": len(prompts),
+                "mean_prompt_tokens": sum(p["input_ids"].shape[-1] for p in prompts)
+                / len(prompts),
+                "generated_tokens": generated,
+                "seconds": dt,
+                "tokens_per_s": generated / dt,
+                "peak_rss_mb": peak_rss_mb(),
+                "peak_rss_per_bucket": per_bucket,
+            }
+        )
+    return rows
+
+
+def print_rows(title: str, rows: list[dict], rate: str) -> None:
+    print(f"\n{title}")
+    for r in rows:
+        rss = f"{r['peak_rss_mb']:8.1f} MB" if r["peak_rss_mb"] is not None else ""
+        print(f"  {r['bucket']:>8s}  {r[rate]:10.2f} {rate}  {rss}")
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="SANTA end-to-end model benchmark")
+    p.add_argument(
+        "--backends", nargs="+", choices=BACKENDS, default=["fp32", "emulator"]
+    )
+    p.add_argument(
+        "--models", nargs="+", choices=("bert", "gpt2"), default=["bert", "gpt2"]
+    )
+    p.add_argument("--port", default="COM3")
+    p.add_argument("--baud", type=int, default=115200)
+    p.add_argument("--per-bucket", type=int, default=100)
+    p.add_argument("--batch-size", type=int, default=1)
+    p.add_argument("--new-tokens", type=int, default=10)
+    p.add_argument("--prompts", help="text file, one GPT-2 prompt per line")
+    p.add_argument("--out", help="write results as JSON")
+    args = p.parse_args(argv)
+    if "gpt2" in args.models and not (1 <= args.new_tokens < MAX_KEYS):
+        p.error(f"--new-tokens must be between 1 and {MAX_KEYS - 1}")
+
+    # SST-2 only when a benchmark reads it.
+    sentences = prompts = None
+    if "bert" in args.models or not args.prompts:
+        import datasets
+
+        sst2 = datasets.load_dataset("glue", "sst2", split="validation")
+        sentences = prompts = sst2["sentence"]
+    if args.prompts:
+        with open(args.prompts, "r") as f:
+            prompts = [ln.strip() for ln in f if ln.strip()]
+
+    emu = open_serial(EMULATOR_PORT)
+    board = None
+    if "board" in args.backends:
+        board = open_serial(args.port, baud=args.baud, timeout=1.0)
+
+    results = {}
+    try:
+        for name in args.models:
+            if name == "bert":
+                tok, base, approx, _ = build_model_BERT(emu)
+                buckets = bucketize(tok, sentences, args.per_bucket)
+            else:
+                tok, base, approx, _ = build_model_GPT2(emu)
+                buckets = bucketize(
+                    tok, prompts, args.per_bucket, MAX_KEYS - args.new_tokens
+                )
+            for backend in args.backends:
+                if backend == "fp32":
+                    model = base
+                else:
+                    attach_serial(approx, emu if backend == "emulator" else board)
+                    model = approx
+                if name == "bert":
+                    rows = bench_bert(tok, model, buckets, args.batch_size)
+                    print_rows(f"BERT SST-2 [{backend}]", rows, "sentences_per_s")
+                else:
+                    rows = bench_gpt2(tok, model, buckets, args.new_tokens)
+                    print_rows(f"GPT-2 generate [{backend}]", rows, "tokens_per_s")
+                results.setdefault(name, {})[backend] = rows
+    finally:
+        close_serial(emu)
+        if board is not None:
+            close_serial(board)
+
+    if args.out:
+        meta = {
+            "port": args.port if board is not None else None,
+            "baud": args.baud,
+            "batch_size": args.batch_size,
+            "new_tokens": args.new_tokens,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+        }
+        with open(args.out, "w") as f:
+            json.dump({"meta": meta, **results}, f, indent=2)
+        print(f"Wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
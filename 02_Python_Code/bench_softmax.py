@@ -0,0 +1,213 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+from softmax_batch import (
+    HW_softmax,
+    open_serial,
+    close_serial,
+    length_mode,
+    frame_count,
+    BYTES_PER_ROW,
+    EMULATOR_PORT,
+)
+from santa_stats import SantaStats
+
+# Driver micro-benchmark: HW_softmax over a grid of lengths and batch sizes,
+# against a board or the emulator.
+#
+#   python bench_softmax.py --out bench.json
+#   python bench_softmax.py --port COM3 --baud 115200 --batches 1 16 --out board.json
+#   python bench_softmax.py --baseline bench.json
+#
+# With --baseline, cases whose rows/s dropped or p99 grew by more than
+# --tolerance are reported and the exit code is 1. On a board, cases whose
+# frames alone need more than --max-wire-s on the link per call are skipped
+# (at 115200 baud the default allows about 220 frames).
+
+# One length per mode boundary (16x4, 32x2, 64x1), one per forwarding group
+# size (modes 3..13 end at 64 * (mode - 1)), and a few just past a boundary
+# where padding is worst.
+DEFAULT_LENGTHS = [1, 8, 16, 17, 32, 33, 64, 65, 100] + [
+    64 * (m - 1) for m in range(3, 14)
+]
+DEFAULT_BATCHES = [1, 16, 256, 4096]
+MODE_NAMES = {0: "16x4", 1: "32x2", 2: "64x1"}
+
+
+def mode_name(len_mode: int) -> str:
+    return MODE_NAMES.get(len_mode, f"fwd{len_mode}")
+
+
+def run_case(
+    ser, L: int, batch: int, repeats: int, rng: np.random.Generator, timeout_s: float
+) -> dict:
+    scores = list(rng.standard_normal((batch, L)).astype(np.float32) * 2.0)
+    HW_softmax(ser, scores, timeout_s=timeout_s)
+
+    stats = SantaStats()
+    wall, cpu = [], []
+    for _ in range(repeats):
+        t0, c0 = time.perf_counter(), time.process_time()
+        HW_softmax(ser, scores, timeout_s=timeout_s, stats=stats)
+        wall.append(time.perf_counter() - t0)
+        cpu.append(time.process_time() - c0)
+
+    s = stats.snapshot()
+    wall = np.asarray(wall)
+    total = wall.sum()
+    lanes_sent = s["lanes_used"] + s["lanes_padded"]
+    return {
+        "L": L,
+        "batch": batch,
+        "mode": mode_name(length_mode(L)),
+        "frames": frame_count(batch, L),
+        "transactions": s["transactions"] // repeats,
+        "rows_per_s": batch * repeats / total,
+        "wire_bytes_per_s": (s["bytes_tx"] + s["bytes_rx"]) / total,
+        "padding_efficiency": s["lanes_used"] / lanes_sent if lanes_sent else 0.0,
+        "cpu_s": float(np.mean(cpu)),
+        "mean_s": float(wall.mean()),
+        "p50_s": float(np.percentile(wall, 50)),
+        "p99_s": float(np.percentile(wall, 99)),
+    }
+
+
+def run_suite(
+    ser,
+    lengths: list[int],
+    batches: list[int],
+    repeats: int,
+    max_frames: int,
+    timeout_s: float = 600.0,
+    seed: int = 0,
+    baud: int | None = None,
+    max_wire_s: float | None = None,
+) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    cases = []
+    for L in lengths:
+        for batch in batches:
+            frames = frame_count(batch, L)
+            if frames > max_frames:
+                continue
+            wire_s = 2 * frames * BYTES_PER_ROW * 10 / baud if baud else 0.0
+            if max_wire_s is not None and wire_s > max_wire_s:
+                print(f"L={L:4d} batch={batch:5d} skipped, ~{wire_s:.0f}s per call")
+                continue
+            case = run_case(ser, L, batch, repeats, rng, timeout_s)
+            cases.append(case)
+            print(
+                f"L={L:4d} batch={batch:5d} {case['mode']:>5s}  "
+                f"{case['rows_per_s']:12.1f} rows/s  "
+                f"{case['wire_bytes_per_s'] / 1e3:10.1f} kB/s  "
+                f"pad eff {case['padding_efficiency']:5.1%}  "
+                f"p50 {case['p50_s'] * 1e3:8.2f} ms  p99 {case['p99_s'] * 1e3:8.2f} ms"
+            )
+    return cases
+
+
+def mode_summary(cases: list[dict]) -> dict:
+    # Padding efficiency per length mode over all batch sizes.
+    out = {}
+    for c in cases:
+        m = out.setdefault(c["mode"], {"cases": 0, "padding_efficiency": 0.0})
+        m["cases"] += 1
+        m["padding_efficiency"] += c["padding_efficiency"]
+    for m in out.values():
+        m["padding_efficiency"] /= m["cases"]
+    return out
+
+
+def compare(cases: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    base = {(c["L"], c["batch"]): c for c in baseline["cases"]}
+    regressions = []
+    print(f"\n{'L':>4s} {'batch':>5s} {'rows/s':>10s} {'p99':>10s}")
+    for c in cases:
+        b = base.get((c["L"], c["batch"]))
+        if b is None:
+            continue
+        speed = c["rows_per_s"] / b["rows_per_s"]
+        tail = c["p99_s"] / b["p99_s"] if b["p99_s"] else 1.0
+        flag = ""
+        if speed < 1.0 - tolerance or tail > 1.0 + tolerance:
+            flag = "  <-- regression"
+            regressions.append(f"L={c['L']} batch={c['batch']}")
+        print(f"{c['L']:4d} {c['batch']:5d} {speed:9.2f}x {tail:9.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="SANTA softmax driver benchmark")
+    p.add_argument("--port", default=EMULATOR_PORT)
+    p.add_argument("--baud", type=int, default=115200)
+    p.add_argument("--lengths", type=int, nargs="+", default=DEFAULT_LENGTHS)
+    p.add_argument("--batches", type=int, nargs="+", default=DEFAULT_BATCHES)
+    p.add_argument("--repeats", type=int, default=5)
+    p.add_argument(
+        "--max-frames",
+        type=int,
+        default=1 << 16,
+        help="skip cases that need more frames per call than this",
+    )
+    p.add_argument(
+        "--max-wire-s",
+        type=float,
+        default=5.0,
+        help="on a board, skip cases whose frames take longer than this per call",
+    )
+    p.add_argument("--out", help="write results as JSON")
+    p.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    p.add_argument("--tolerance", type=float, default=0.10)
+    args = p.parse_args(argv)
+
+    if any(not (1 <= L <= 768) for L in args.lengths):
+        p.error("lengths must be between 1 and 768")
+
+    ser = open_serial(args.port, baud=args.baud, timeout=1.0)
+    try:
+        cases = run_suite(
+            ser,
+            args.lengths,
+            args.batches,
+            args.repeats,
+            args.max_frames,
+            baud=args.baud,
+            max_wire_s=None if args.port == EMULATOR_PORT else args.max_wire_s,
+        )
+    finally:
+        close_serial(ser)
+
+    result = {
+        "meta": {
+            "port": args.port,
+            "baud": args.baud,
+            "repeats": args.repeats,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "modes": mode_summary(cases),
+        "cases": cases,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(cases, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+        print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from softmax_batch import BYTES_PER_ROW, MAX_DEPTH, length_modes
+
+# Where the tree-bypass speedup comes from, without hardware: tokenize a
+# dataset and count, for every sentence and layer of BERT, the frames and
+# UART bytes HW_softmax would send with the adaptive 16x4 / 32x2 / 64x1
+# modes and with a fixed 64x1 design (one softmax per frame). Lengths past
+# 64 use the forwarding modes in both designs.
+#
+#   python length_report.py                       # SST-2 validation
+#   python length_report.py --text prompts.txt --batch 8 --out lengths.json
+#
+# The link moves every frame twice (request and reply) and the core takes
+# one frame per clock, so both the wire-bound and the core-bound speedup
+# are the frame ratio; wire bytes also count the depth byte per transaction.
+
+BUCKETS = [(1, 16), (17, 32), (33, 64), (65, 128), (129, 768)]
+LAYERS = 12
+HEADS = 12
+
+
+def design_frames(rows: np.ndarray, modes: np.ndarray, adaptive: bool) -> tuple:
+    # rows: softmax rows per (batch, mode) cell; returns frames and
+    # transactions per cell, split per mode like split_depths(). With
+    # --batch > 1 plan_transactions() can share a transaction between modes,
+    # so this overcounts depth bytes slightly; the frames are exact.
+    if adaptive:
+        per_frame = np.where(modes == 0, 4, np.where(modes == 1, 2, 1))
+    else:
+        per_frame = np.ones_like(modes)
+    group = np.where(modes <= 2, 1, modes - 1)
+    frames = np.where(
+        modes <= 2, -(-rows // per_frame), rows * np.maximum(modes - 1, 1)
+    )
+    groups_per_tx = (MAX_DEPTH + 1) // group
+    transactions = -(-(frames // group) // groups_per_tx)
+    return frames, transactions
+
+
+def count(lengths: np.ndarray, batch: int, layers: int, heads: int) -> dict:
+    # Sentences go to the board `batch` at a time in dataset order; within a
+    # call the rows of one length mode share frames, as in HW_softmax_varlen.
+    n = np.asarray(lengths, dtype=np.int64)
+    modes = length_modes(n)
+    cell = (np.arange(len(n)) // batch) * 16 + modes
+    rows = np.bincount(cell, weights=heads * n, minlength=16).astype(np.int64)
+    live = np.flatnonzero(rows)
+    rows, cell_modes = rows[live], live % 16
+
+    out = {
+        "sentences": int(len(n)),
+        "tokens": int(n.sum()),
+        "softmax_rows": int(rows.sum()) * layers,
+        "lanes_used": int((heads * n * n).sum()) * layers,
+    }
+    for name, adaptive in (("adaptive", True), ("fixed64", False)):
+        frames, transactions = design_frames(rows, cell_modes, adaptive)
+        f = int(frames.sum()) * layers
+        t = int(transactions.sum()) * layers
+        out[name] = {
+            "frames": f,
+            "transactions": t,
+            "wire_bytes": t + 2 * f * BYTES_PER_ROW,
+            "padding_waste": 1.0 - out["lanes_used"] / (64 * f) if f else 0.0,
+        }
+    a, b = out["adaptive"], out["fixed64"]
+    out["frame_speedup"] = b["frames"] / a["frames"] if a["frames"] else 0.0
+    out["wire_speedup"] = b["wire_bytes"] / a["wire_bytes"] if a["wire_bytes"] else 0.0
+    return out
+
+
+def report(lengths: np.ndarray, batch: int, layers: int, heads: int) -> dict:
+    n = np.asarray(lengths, dtype=np.int64)
+    buckets = {}
+    for lo, hi in BUCKETS:
+        sel = n[(n >= lo) & (n <= hi)]
+        if len(sel):
+            buckets[f"{lo}-{hi}"] = count(sel, batch, layers, heads)
+    return {
+        "mean_tokens": float(n.mean()) if len(n) else 0.0,
+        "buckets": buckets,
+        "total": count(n, batch, layers, heads),
+    }
+
+
+def token_lengths(texts: list[str], tokenizer: str, max_length: int) -> np.ndarray:
+    from transformers import AutoTokenizer
+
+    tok = AutoTokenizer.from_pretrained(tokenizer)
+    ids = tok(texts, truncation=True, max_length=max_length)["input_ids"]
+    return np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(ids))
+
+
+def print_report(r: dict) -> None:
+    print(
+        f"{'bucket':>8s} {'sents':>6s} {'frames 64x1':>12s} {'frames adapt':>12s} "
+        f"{'speedup':>8s} {'wire':>6s} {'waste 64x1':>10s} {'waste adapt':>11s}"
+    )
+    for name, c in [*r["buckets"].items(), ("all", r["total"])]:
+        print(
+            f"{name:>8s} {c['sentences']:6d} {c['fixed64']['frames']:12d} "
+            f"{c['adaptive']['frames']:12d} {c['frame_speedup']:7.2f}x "
+            f"{c['wire_speedup']:5.2f}x {c['fixed64']['padding_waste']:10.1%} "
+            f"{c['adaptive']['padding_waste']:11.1%}"
+        )
+    print(f"Mean length {r['mean_tokens']:.1f} tokens")
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="SANTA length-distribution report")
+    p.add_argument("--text", help="text file, one sentence per line (default SST-2)")
+    p.add_argument("--tokenizer", default="bert-base-uncased")
+    p.add_argument("--max-length", type=int, default=512)
+    p.add_argument("--batch", type=int, default=1, help="sentences per softmax call")
+    p.add_argument("--layers", type=int, default=LAYERS)
+    p.add_argument("--heads", type=int, default=HEADS)
+    p.add_argument("--out", help="write the report as JSON")
+    args = p.parse_args(argv)
+    if not (1 <= args.max_length <= 768):
+        p.error("--max-length must be between 1 and 768")
+
+    if args.text:
+        with open(args.text, "r") as f:
+            texts = [ln.strip() for ln in f if ln.strip()]
+        source = args.text
+    else:
+        import datasets
+
+        texts = datasets.load_dataset("glue", "sst2", split="validation")["sentence"]
+        source = "glue/sst2 validation"
+
+    t0 = time.perf_counter()
+    lengths = token_lengths(texts, args.tokenizer, args.max_length)
+    t1 = time.perf_counter()
+    r = report(lengths, args.batch, args.layers, args.heads)
+    t2 = time.perf_counter()
+    print_report(r)
+    print(
+        f"Tokenized {len(texts)} sentences in {t1 - t0:.2f}s, counted in {t2 - t1:.3f}s"
+    )
+
+    if args.out:
+        r["meta"] = {
+            "source": source,
+            "tokenizer": args.tokenizer,
+            "batch": args.batch,
+            "layers": args.layers,
+            "heads": args.heads,
+        }
+        with open(args.out, "w") as f:
+            json.dump(r, f, indent=2)
+        print(f"Wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+import asyncio
+import threading
+from collections import deque
+import numpy as np
+import serial
+from concurrent.futures import ThreadPoolExecutor, wait
+from softmax_batch import HW_softmax_varlen, open_serial, close_serial, _transact
+from santa_stats import SantaStats, format_metric, cache_metrics
+from santa_trace import tee
+
+# One board, many callers. Requests queue up while a dispatch is on the wire
+# and the next dispatch carries all of them, so rows from different requests
+# (and different length modes) share 128-row transactions. Each caller gets
+# back exactly its own rows.
+
+
+class AsyncSantaDevice:
+
+    def __init__(
+        self,
+        ser: serial.Serial,
+        *,
+        pad_value: float = -32.0,
+        timeout_s: float = 10.0,
+        cache=None,
+        linger_s: float = 0.0,
+    ):
+        self.ser = ser
+        self.pad_value = pad_value
+        self.timeout_s = timeout_s
+        self.cache = cache
+        self.linger_s = linger_s
+
+        self.requests = 0
+        self.dispatches = 0
+        self.rows = 0
+        self.metrics = SantaStats()
+        self.tracer = None
+
+        self._pending: list[tuple[np.ndarray, np.ndarray, asyncio.Future]] = []
+        self._inflight: list[tuple[np.ndarray, np.ndarray, asyncio.Future]] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._wake: asyncio.Event | None = None
+        self._worker: asyncio.Task | None = None
+        self._io: ThreadPoolExecutor | None = None
+
+    async def start(self) -> "AsyncSantaDevice":
+        if self._worker is not None:
+            return self
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._wake = asyncio.Event()
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="santa-uart")
+        self._worker = self._loop.create_task(self._run())
+        return self
+
+    async def close(self) -> None:
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        pending, self._pending = self._inflight + self._pending, []
+        for _, _, fut in pending:
+            if not fut.done():
+                fut.set_exception(ConnectionError("SANTA device closed."))
+        self._io.shutdown(wait=True)
+
+    async def __aenter__(self) -> "AsyncSantaDevice":
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def softmax(
+        self, scores: np.ndarray, lengths: np.ndarray | None = None
+    ) -> np.ndarray:
+        if self._worker is None:
+            raise RuntimeError("Device is not started. Call await device.start().")
+        x = np.asarray(scores, dtype=np.float32)
+        if x.ndim != 2:
+            raise ValueError(f"scores must be 2D (N, L), got shape {x.shape}")
+        N, L = x.shape
+        if lengths is None:
+            lens = np.full((N,), L, dtype=np.int64)
+        else:
+            lens = np.asarray(lengths, dtype=np.int64).reshape(-1)
+            if lens.shape != (N,):
+                raise ValueError(f"lengths must have shape ({N},), got {lens.shape}")
+        if N == 0:
+            return np.zeros((0, L), dtype=np.float32)
+        if lens.min() < 1 or lens.max() > min(L, 768):
+            raise ValueError(f"lengths must be between 1 and {min(L, 768)}")
+
+        fut = self._loop.create_future()
+        self._pending.append((x, lens, fut))
+        self.requests += 1
+        self._wake.set()
+        return await fut
+
+    def softmax_blocking(
+        self,
+        scores: np.ndarray,
+        lengths: np.ndarray | None = None,
+        timeout: float | None = None,
+    ) -> np.ndarray:
+        # For synchronous model code running in worker threads.
+        if self._loop is None:
+            raise RuntimeError("Device is not started. Call await device.start().")
+        if threading.get_ident() == self._loop_thread:
+            raise RuntimeError("softmax_blocking() called from the event loop thread")
+        coro = self.softmax(scores, lengths)
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def set_tracer(self, tracer) -> None:
+        self.tracer = tracer
+
+    def stats(self) -> dict:
+        out = {
+            "requests": self.requests,
+            "dispatches": self.dispatches,
+            "rows": self.rows,
+            **self.metrics.snapshot(),
+        }
+        if self.cache is not None:
+            out["cache"] = self.cache.stats()
+        if hasattr(self.ser, "transactions"):
+            out["boards"] = dict(zip(self.ser.ports, self.ser.transactions))
+        return out
+
+    def prometheus(self, prefix: str = "santa") -> str:
+        lines = [
+            *format_metric(f"{prefix}_up", "gauge", "Board attached.", [({}, 1)]),
+            *format_metric(
+                f"{prefix}_requests_total",
+                "counter",
+                "Softmax requests submitted.",
+                [({}, self.requests)],
+            ),
+            *format_metric(
+                f"{prefix}_dispatches_total",
+                "counter",
+                "Coalesced dispatches to the board.",
+                [({}, self.dispatches)],
+            ),
+            *format_metric(
+                f"{prefix}_dispatch_rows_total",
+                "counter",
+                "Softmax rows dispatched.",
+                [({}, self.rows)],
+            ),
+            *self.metrics.prometheus_lines(prefix),
+        ]
+        if self.cache is not None:
+            lines += cache_metrics(self.cache, prefix)
+        if hasattr(self.ser, "transactions"):
+            lines += format_metric(
+                f"{prefix}_board_transactions_total",
+                "counter",
+                "Transactions completed per board.",
+                [
+                    ({"port": p}, n)
+                    for p, n in zip(self.ser.ports, self.ser.transactions)
+                ],
+            )
+            lines += format_metric(
+                f"{prefix}_board_up",
+                "gauge",
+                "Board still in the pool.",
+                [({"port": p}, int(p not in self.ser.dropped)) for p in self.ser.ports],
+            )
+        return "\n".join(lines) + "\n"
+
+    def _dispatch(self, rows: np.ndarray, lens: np.ndarray) -> np.ndarray:
+        stats = tee(self.metrics, self.tracer)
+        with stats.timed("dispatch"):
+            return HW_softmax_varlen(
+                self.ser,
+                rows,
+                lens,
+                pad_value=self.pad_value,
+                timeout_s=self.timeout_s,
+                cache=self.cache,
+                stats=stats,
+            )
+
+    async def _run(self) -> None:
+        while True:
+            await self._wake.wait()
+            if self.linger_s > 0:
+                await asyncio.sleep(self.linger_s)
+            self._wake.clear()
+            batch = [p for p in self._pending if not p[2].done()]
+            self._pending = []
+            if not batch:
+                continue
+            self._inflight = batch
+
+            width = max(x.shape[1] for x, _, _ in batch)
+            n_rows = sum(x.shape[0] for x, _, _ in batch)
+            rows = np.full((n_rows, width), self.pad_value, dtype=np.float32)
+            r0 = 0
+            for x, _, _ in batch:
+                rows[r0 : r0 + x.shape[0], : x.shape[1]] = x
+                r0 += x.shape[0]
+            lens = np.concatenate([l for _, l, _ in batch])
+
+            try:
+                probs = await self._loop.run_in_executor(
+                    self._io, self._dispatch, rows, lens
+                )
+            except Exception as e:
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                self._inflight = []
+                continue
+
+            self.dispatches += 1
+            self.rows += n_rows
+            r0 = 0
+            for x, _, fut in batch:
+                n, L = x.shape
+                if not fut.done():
+                    fut.set_result(probs[r0 : r0 + n, :L].copy())
+                r0 += n
+            self._inflight = []
+
+
+class SantaDevicePool:
+    # Several boards behind one "port". Each board has its own I/O thread that
+    # pulls the next transaction from a shared queue, so faster links take
+    # more of the work; results land in place in rx. A board whose
+    # transaction fails is dropped and the transaction goes back on the queue
+    # for the others. Pass the pool anywhere a serial port is accepted.
+
+    def __init__(
+        self, ports: list[str], baud: int = 115200, timeout: float = 1.0
+    ) -> None:
+        if not ports:
+            raise ValueError("ports must not be empty")
+        self.ports = list(ports)
+        self.devices: list[serial.Serial] = []
+        self.dropped: dict[str, Exception] = {}
+        for port in self.ports:
+            try:
+                self.devices.append(open_serial(port, baud=baud, timeout=timeout))
+            except Exception as e:
+                print(f"[Warning] Failed to open SANTA board on {port}: {e}")
+                self.devices.append(None)
+                self.dropped[port] = e
+        if not self.live:
+            raise ConnectionError(f"No SANTA board could be opened on {self.ports}")
+        self.transactions = [0] * len(self.ports)
+        self._lock = threading.Lock()
+        self._io = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"santa-uart-{i}")
+            for i in range(len(self.ports))
+        ]
+
+    @property
+    def live(self) -> list[int]:
+        return [i for i, ser in enumerate(self.devices) if ser is not None]
+
+    @property
+    def is_open(self) -> bool:
+        return bool(self.live)
+
+    def _drop(self, i: int, err: Exception) -> None:
+        with self._lock:
+            ser, self.devices[i] = self.devices[i], None
+            self.dropped[self.ports[i]] = err
+        print(f"[Warning] Dropping SANTA board on {self.ports[i]}: {err}")
+        try:
+            close_serial(ser)
+        except Exception:
+            pass
+
+    def _drain(self, i, todo: deque, tx, rx, timeout_s: float, stats) -> None:
+        ser = self.devices[i]
+        while True:
+            with self._lock:
+                if not todo or self.devices[i] is None:
+                    return
+                r0, r1 = todo.popleft()
+            try:
+                _transact(ser, tx[r0:r1], rx[r0:r1], timeout_s, stats=stats)
+            except Exception as e:
+                with self._lock:
+                    todo.appendleft((r0, r1))
+                self._drop(i, e)
+                return
+            self.transactions[i] += 1
+
+    def run_transactions(
+        self,
+        tx: np.ndarray,
+        rx: np.ndarray,
+        depth_list: list[int],
+        timeout_s: float,
+        stats=None,
+    ) -> None:
+        bounds = np.cumsum([0] + [d + 1 for d in depth_list]).tolist()
+        todo = deque(zip(bounds[:-1], bounds[1:]))
+        while todo:
+            live = self.live
+            if not live:
+                raise ConnectionError(
+                    f"All SANTA boards dropped: {list(self.dropped.items())}"
+                )
+            futs = [
+                self._io[i].submit(self._drain, i, todo, tx, rx, timeout_s, stats)
+                for i in live
+            ]
+            wait(futs)
+
+    def close(self) -> None:
+        for i in self.live:
+            close_serial(self.devices[i])
+            self.devices[i] = None
+        for io in self._io:
+            io.shutdown(wait=True)
+
+
+def open_device(ports, baud: int = 115200, timeout: float = 1.0):
+    # A single port name gives a plain serial port, a list gives a pool.
+    if isinstance(ports, str):
+        return open_serial(ports, baud=baud, timeout=timeout)
+    if len(ports) == 1:
+        return open_serial(ports[0], baud=baud, timeout=timeout)
+    return SantaDevicePool(ports, baud=baud, timeout=timeout)
@@ -0,0 +1,361 @@
+import sys
+import json
+import heapq
+import argparse
+from collections import deque
+import numpy as np
+from softmax_batch import (
+    BYTES_PER_ROW,
+    length_modes,
+    mode_capacity,
+    frame_count,
+    plan_transactions,
+)
+
+# Capacity planning for SANTA boards: a discrete-event model of a workload
+# (BERT / GPT-2 requests with their sequence lengths and arrival times) going
+# through the driver's packing and transaction planning, the UART link and
+# the core pipeline of 1..N boards. Nothing here talks to hardware.
+#
+#   python santa_sim.py --model bert --lengths 16 32 64 128 --requests 200 \
+#       --rate 2 --bauds 115200 921600 3000000 --boards 4
+#   python santa_sim.py --trace workload.jsonl --boards 8 --out sim.json
+#
+# A trace has one JSON request per line:
+#   {"t": 0.0, "model": "gpt2", "length": 40, "new_tokens": 10}
+#   {"t": 0.5, "model": "bert", "length": 24, "batch": 8, "heads": 12}
+# "t" (arrival, seconds) is optional; without it requests arrive as a Poisson
+# process at --rate, or all at t=0 when no rate is given (pure throughput).
+
+CLK_HZ = 100e6
+BITS_PER_BYTE = 10  # start + 8 data + stop
+
+# Core pipeline depth in clocks, from the RTL. The tree outputs for the 16
+# and 32-wide modes are re-timed to the 64-wide tap, and the forwarding
+# stages sit in the path for every mode, so all modes see the same fill
+# latency; the table is per mode so a retimed core can be modelled.
+BRAM_READ_CYCLES = 3  # BRAM_FSM valid pipe
+MAX_TREE_CYCLES = 6  # max_tree_64 (16/32 modes tap earlier, then re-timed)
+MAX_FORWARDING_CYCLES = 12  # max_forwarding bypass, longest group is 12 rows
+RU_CYCLES = 11  # RU: log2 3 + sub 2 + mult 4 + pow2 2
+ADDER_TREE_CYCLES = 12  # adder_tree_64, 2 clocks per level
+ACC_FORWARDING_CYCLES = 12  # acc_forwarding bypass
+BRAM_WRITE_CYCLES = 1
+PIPELINE_CYCLES = np.full(
+    (16,),
+    BRAM_READ_CYCLES
+    + MAX_TREE_CYCLES
+    + MAX_FORWARDING_CYCLES
+    + RU_CYCLES
+    + ADDER_TREE_CYCLES
+    + ACC_FORWARDING_CYCLES
+    + RU_CYCLES
+    + BRAM_WRITE_CYCLES,
+)
+# uart_bram_controller: start / done handshakes around the core, then 4
+# clocks to fetch each reply row from BRAM and 2 clocks per byte between
+# tx_done and the next tx_start.
+FSM_CYCLES = 4
+TX_ROW_CYCLES = 4
+TX_BYTE_CYCLES = 2
+
+MODELS = {
+    "bert": {"layers": 12, "heads": 12},
+    "gpt2": {"layers": 12, "heads": 12},
+}
+DEFAULT_BAUDS = [115200, 921600, 3000000]
+
+
+class Board:
+    # Timing of one board at a given line rate. The divisor is an integer
+    # number of clocks per bit, so the effective baud can differ slightly.
+
+    def __init__(self, baud: int, clk_hz: float = CLK_HZ):
+        self.divisor = max(1, round(clk_hz / baud))
+        self.clk_hz = clk_hz
+        self.baud = clk_hz / self.divisor
+        self.byte_s = BITS_PER_BYTE * self.divisor / clk_hz
+
+    def wire_s(self, rows: int) -> float:
+        # Request (depth byte + rows) and reply, as the controller paces them.
+        request = (1 + rows * BYTES_PER_ROW) * self.byte_s
+        gaps = rows * (TX_ROW_CYCLES + BYTES_PER_ROW * TX_BYTE_CYCLES) / self.clk_hz
+        return request + rows * BYTES_PER_ROW * self.byte_s + gaps
+
+    def core_s(self, rows: int, len_mode: int) -> float:
+        # One row enters the pipeline per clock.
+        return (rows + PIPELINE_CYCLES[len_mode] + FSM_CYCLES) / self.clk_hz
+
+
+def plan_dispatch(lengths: np.ndarray) -> tuple[list[tuple[int, int]], int, int]:
+    # Packs one softmax call the way HW_softmax_varlen does: one bin per
+    # length mode, then transactions from plan_transactions(). Returns
+    # (rows, dominant mode) per transaction and the lanes used / sent.
+    lens = np.asarray(lengths, dtype=np.int64)
+    modes = length_modes(lens)
+    unit_sizes, frame_modes = [], []
+    sent = 0
+    for m in np.unique(modes).tolist():
+        n_frames = frame_count(int((modes == m).sum()), mode_capacity(m))
+        group = 1 if m <= 2 else m - 1
+        unit_sizes.append(np.full((n_frames // group,), group))
+        frame_modes.append(np.full((n_frames,), m))
+        sent += n_frames * 64
+    order, depth_list = plan_transactions(np.concatenate(unit_sizes))
+    tx_modes = np.concatenate(frame_modes)[order]
+    txs = []
+    r0 = 0
+    for depth in depth_list:
+        part = tx_modes[r0 : r0 + depth + 1]
+        txs.append((depth + 1, int(np.bincount(part).argmax())))
+        r0 += depth + 1
+    return txs, int(lens.sum()), sent
+
+
+def request_dispatches(req: dict) -> list[np.ndarray]:
+    # Softmax row lengths of each call the approximate model makes, in order.
+    shape = {**MODELS[req["model"]], **req}
+    T = int(req["length"])
+    heads = int(shape["heads"]) * int(req.get("batch", 1))
+    if req["model"] == "bert":
+        return [np.full((heads * T,), T)] * int(shape["layers"])
+    # GPT-2 with the KV cache: a causal prefill, then one query row per head
+    # and layer for every further token.
+    calls = [np.tile(np.arange(1, T + 1), heads)] * int(shape["layers"])
+    for k in range(1, int(req.get("new_tokens", 1))):
+        calls += [np.full((heads,), T + k)] * int(shape["layers"])
+    return calls
+
+
+def build_workload(requests: list[dict], board: Board, host_row_s: float) -> list:
+    # Per request: arrival time, and per dispatch its transactions as
+    # (wire_s, core_s), its softmax rows and the host time before it.
+    plans = {}
+    out = []
+    for req in requests:
+        dispatches = []
+        for lens in request_dispatches(req):
+            key = (len(lens), lens.tobytes())
+            if key not in plans:
+                plans[key] = plan_dispatch(lens)
+            txs, used, sent = plans[key]
+            dispatches.append(
+                {
+                    "tx": [(board.wire_s(n), board.core_s(n, m)) for n, m in txs],
+                    "rows": len(lens),
+                    "frames": sum(n for n, _ in txs),
+                    "lanes_used": used,
+                    "lanes_sent": sent,
+                    "host_s": host_row_s * len(lens),
+                }
+            )
+        out.append((float(req.get("t", 0.0)), dispatches))
+    return out
+
+
+def simulate(workload: list, n_boards: int) -> dict:
+    # Each request runs its dispatches one after another; the transactions of
+    # a dispatch go on one FIFO shared by all boards (as in SantaDevicePool),
+    # and an idle board takes the next one. A board handles one transaction
+    # at a time: request on the wire, core, reply on the wire.
+    events = []
+    seq = 0
+
+    def push(t, kind, *args):
+        nonlocal seq
+        heapq.heappush(events, (t, seq, kind, args))
+        seq += 1
+
+    for r, (arrival, dispatches) in enumerate(workload):
+        push(arrival + dispatches[0]["host_s"], "ready", r, 0)
+
+    queue = deque()
+    idle = list(range(n_boards))
+    left = {}
+    wire_busy = core_busy = 0.0
+    done_at = [0.0] * len(workload)
+    tx_wait = []
+
+    def start(now):
+        nonlocal wire_busy, core_busy
+        while idle and queue:
+            b = idle.pop()
+            queued, r, k, (wire_s, core_s) = queue.popleft()
+            tx_wait.append(now - queued)
+            wire_busy += wire_s
+            core_busy += core_s
+            push(now + wire_s + core_s, "done", b, r, k)
+
+    while events:
+        now, _, kind, args = heapq.heappop(events)
+        if kind == "ready":
+            r, k = args
+            txs = workload[r][1][k]["tx"]
+            left[r, k] = len(txs)
+            queue.extend((now, r, k, tx) for tx in txs)
+        else:
+            b, r, k = args
+            idle.append(b)
+            left[r, k] -= 1
+            if not left[r, k]:
+                dispatches = workload[r][1]
+                if k + 1 < len(dispatches):
+                    push(now + dispatches[k + 1]["host_s"], "ready", r, k + 1)
+                else:
+                    done_at[r] = now
+        start(now)
+
+    arrivals = np.array([a for a, _ in workload])
+    latency = np.asarray(done_at) - arrivals
+    # Unloaded latency: the same request alone on one board.
+    alone = np.array(
+        [
+            sum(d["host_s"] + sum(w + c for w, c in d["tx"]) for d in dispatches)
+            for _, dispatches in workload
+        ]
+    )
+    queueing = np.maximum(latency - alone, 0.0)
+    makespan = max(done_at) - arrivals.min()
+    rows = sum(d["rows"] for _, ds in workload for d in ds)
+    frames = sum(d["frames"] for _, ds in workload for d in ds)
+    used = sum(d["lanes_used"] for _, ds in workload for d in ds)
+    sent = sum(d["lanes_sent"] for _, ds in workload for d in ds)
+    return {
+        "boards": n_boards,
+        "requests": len(workload),
+        "rows": rows,
+        "frames": frames,
+        "transactions": len(tx_wait),
+        "seconds": makespan,
+        "rows_per_s": rows / makespan if makespan else 0.0,
+        "requests_per_s": len(workload) / makespan if makespan else 0.0,
+        "link_utilization": wire_busy / (n_boards * makespan) if makespan else 0.0,
+        "core_utilization": core_busy / (n_boards * makespan) if makespan else 0.0,
+        "padding_efficiency": used / sent if sent else 0.0,
+        "latency_p50_s": float(np.percentile(latency, 50)),
+        "latency_p99_s": float(np.percentile(latency, 99)),
+        "queueing_p50_s": float(np.percentile(queueing, 50)),
+        "queueing_p99_s": float(np.percentile(queueing, 99)),
+        "tx_wait_p99_s": float(np.percentile(tx_wait, 99)) if tx_wait else 0.0,
+    }
+
+
+def synthetic_requests(
+    models: list[str],
+    lengths: list[int],
+    n: int,
+    rate: float | None,
+    new_tokens: int,
+    batch: int,
+    rng: np.random.Generator,
+) -> list[dict]:
+    t = 0.0
+    out = []
+    for _ in range(n):
+        req = {
+            "model": str(rng.choice(models)),
+            "length": int(rng.choice(lengths)),
+            "batch": batch,
+            "t": t,
+        }
+        if req["model"] == "gpt2":
+            req["new_tokens"] = new_tokens
+        out.append(req)
+        if rate:
+            t += float(rng.exponential(1.0 / rate))
+    return out
+
+
+def load_trace(path: str, rate: float | None, rng: np.random.Generator) -> list:
+    with open(path, "r") as f:
+        reqs = [json.loads(ln) for ln in f if ln.strip()]
+    t = 0.0
+    for req in reqs:
+        if req.get("model") not in MODELS:
+            raise ValueError(f"unknown model in trace: {req.get('model')!r}")
+        if "t" not in req:
+            req["t"] = t
+            if rate:
+                t += float(rng.exponential(1.0 / rate))
+    return reqs
+
+
+def check_lengths(requests: list[dict]) -> None:
+    for req in requests:
+        top = int(req["length"]) + int(req.get("new_tokens", 1)) - 1
+        if not (1 <= int(req["length"]) and top <= 768):
+            raise ValueError(f"sequence lengths must stay within 1..768: {req}")
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="SANTA capacity simulator")
+    p.add_argument("--trace", help="JSON lines workload, one request per line")
+    p.add_argument(
+        "--model", nargs="+", choices=tuple(MODELS), default=["bert"], dest="models"
+    )
+    p.add_argument("--lengths", type=int, nargs="+", default=[16, 32, 64, 128])
+    p.add_argument("--requests", type=int, default=100)
+    p.add_argument("--rate", type=float, help="request arrivals per second")
+    p.add_argument("--new-tokens", type=int, default=10)
+    p.add_argument("--batch", type=int, default=1)
+    p.add_argument("--bauds", type=int, nargs="+", default=DEFAULT_BAUDS)
+    p.add_argument("--boards", type=int, default=4, help="simulate 1..N boards")
+    p.add_argument(
+        "--host-us-per-row",
+        type=float,
+        default=0.0,
+        help="host pack + decode time per softmax row",
+    )
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", help="write results as JSON")
+    args = p.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    if args.trace:
+        requests = load_trace(args.trace, args.rate, rng)
+    else:
+        requests = synthetic_requests(
+            args.models,
+            args.lengths,
+            args.requests,
+            args.rate,
+            args.new_tokens,
+            args.batch,
+            rng,
+        )
+    try:
+        check_lengths(requests)
+    except ValueError as e:
+        p.error(str(e))
+
+    results = []
+    print(
+        f"{'baud':>9s} {'boards':>6s} {'rows/s':>10s} {'req/s':>8s} "
+        f"{'link':>6s} {'core':>7s} {'p50':>9s} {'p99':>9s} {'queue p99':>10s}"
+    )
+    for baud in args.bauds:
+        board = Board(baud)
+        workload = build_workload(requests, board, args.host_us_per_row * 1e-6)
+        for n in range(1, args.boards + 1):
+            r = {"baud": baud, "effective_baud": board.baud, **simulate(workload, n)}
+            results.append(r)
+            print(
+                f"{baud:9d} {n:6d} {r['rows_per_s']:10.1f} "
+                f"{r['requests_per_s']:8.2f} {r['link_utilization']:6.1%} "
+                f"{r['core_utilization']:7.3%} {r['latency_p50_s']:8.3f}s "
+                f"{r['latency_p99_s']:8.3f}s {r['queueing_p99_s']:9.3f}s"
+            )
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(
+                {"meta": vars(args), "requests": requests, "results": results},
+                f,
+                indent=2,
+            )
+        print(f"Wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+import io
+import time
+import threading
+import weakref
+import urllib.request
+from contextlib import contextmanager
+import numpy as np
+import torch
+from softmax_batch import HW_softmax_varlen, open_serial, close_serial, EMULATOR_PORT
+from softmax_torch import softmax_approx
+
+# Where the approximate attention modules send their softmax rows. Every
+# backend takes 2D scores (N, L) and per-row lengths (default L) and returns
+# float32 probabilities of the same shape, zero past each row's length:
+#
+#   fp32      exact torch.softmax, no quantization
+#   q610      the core's integer pipeline in torch ("q610:compile" to
+#             torch.compile it), bit-exact with a board
+#   emulator  the Q6.10 software model of the core, through the driver
+#   board     one SANTA board, or a SantaDevicePool ("pool")
+#   device    an AsyncSantaDevice shared by several callers
+#   remote    another process serving POST /softmax (the demo app does)
+#
+# Backends with softmax_tensor() (fp32, q610) take torch tensors of any
+# shape, and the attention modules then never leave torch.
+#
+# A list of backends is tried in order, so the fastest one that works
+# serves the request and the rest are fallbacks:
+#
+#   backend = make_backend(["pool:COM3,COM4", "emulator"])
+#   set_backend_to_model(approx_model, backend)
+#   with using_backend(approx_model, make_backend("fp32")):
+#       approx_model(**inputs)
+
+
+def _lengths(lengths, N: int, L: int) -> np.ndarray:
+    if lengths is None:
+        return np.full((N,), L, dtype=np.int64)
+    lens = np.asarray(lengths, dtype=np.int64).reshape(-1)
+    if lens.shape != (N,):
+        raise ValueError(f"lengths must have shape ({N},), got {lens.shape}")
+    return lens
+
+
+class SoftmaxBackend:
+    name = "backend"
+
+    def softmax(self, scores, lengths=None, *, cache=None, stats=None) -> np.ndarray:
+        raise NotImplementedError
+
+    def set_tracer(self, tracer) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.name}>"
+
+
+class TorchBackend(SoftmaxBackend):
+    name = "fp32"
+
+    def softmax_tensor(self, scores: torch.Tensor, lengths=None) -> torch.Tensor:
+        L = scores.shape[-1]
+        if lengths is None:
+            return torch.softmax(scores, dim=-1)
+        n = torch.as_tensor(lengths, device=scores.device).expand(scores.shape[:-1])
+        live = torch.arange(L, device=scores.device) < n.unsqueeze(-1)
+        p = torch.softmax(scores.masked_fill(~live, float("-inf")), dim=-1)
+        return p.masked_fill(~live, 0.0)
+
+    def softmax(self, scores, lengths=None, *, cache=None, stats=None) -> np.ndarray:
+        x = torch.from_numpy(np.asarray(scores, dtype=np.float32))
+        lens = torch.from_numpy(_lengths(lengths, *x.shape))
+        return self.softmax_tensor(x, lens).numpy()
+
+
+class TorchApproxBackend(TorchBackend):
+    name = "q610"
+
+    def __init__(self, compile: bool = False):
+        self.kernel = softmax_approx
+        if compile:
+            self.kernel = torch.compile(softmax_approx, dynamic=True)
+
+    def softmax_tensor(self, scores: torch.Tensor, lengths=None) -> torch.Tensor:
+        return self.kernel(scores, lengths)
+
+
+_PORT_LOCKS = weakref.WeakKeyDictionary()
+_PORT_LOCKS_GUARD = threading.Lock()
+
+
+def _port_lock(ser) -> threading.Lock:
+    # One lock per port object, shared by every SerialBackend wrapping it
+    # (set_serial() wraps the same port once per attention module) and
+    # dropped with the port.
+    with _PORT_LOCKS_GUARD:
+        lock = _PORT_LOCKS.get(ser)
+        if lock is None:
+            lock = _PORT_LOCKS[ser] = threading.Lock()
+        return lock
+
+
+class SerialBackend(SoftmaxBackend):
+    # Anything HW_softmax_varlen accepts as a port: a serial.Serial, the
+    # emulator or a SantaDevicePool. A port carries one transaction at a
+    # time (send_frame drops whatever is in the input buffer), so calls from
+    # several threads are serialized. Calls spanning several transactions
+    # decode each reply while the next is in flight unless pipelined=False.
+
+    def __init__(
+        self,
+        ser,
+        name: str = "board",
+        pad_value: float = -32.0,
+        timeout_s: float = 10.0,
+        owned: bool = False,
+        pipelined: bool = True,
+    ):
+        self.ser = ser
+        self.name = name
+        self.pad_value = pad_value
+        self.timeout_s = timeout_s
+        self.owned = owned
+        self.pipelined = pipelined
+        self._lock = _port_lock(ser)
+
+    def softmax(self, scores, lengths=None, *, cache=None, stats=None) -> np.ndarray:
+        x = np.asarray(scores, dtype=np.float32)
+        lens = _lengths(lengths, *x.shape)
+        with self._lock:
+            return HW_softmax_varlen(
+                self.ser,
+                x,
+                lens,
+                pad_value=self.pad_value,
+                timeout_s=self.timeout_s,
+                cache=cache,
+                stats=stats,
+                pipelined=self.pipelined,
+            )
+
+    def close(self) -> None:
+        if self.owned:
+            if hasattr(self.ser, "devices"):
+                self.ser.close()
+            else:
+                close_serial(self.ser)
+
+
+class DeviceBackend(SoftmaxBackend):
+    # The device coalesces requests and keeps its own cache and stats.
+    name = "device"
+
+    def __init__(self, device, timeout_s: float | None = None):
+        self.device = device
+        self.timeout_s = timeout_s
+
+    def softmax(self, scores, lengths=None, *, cache=None, stats=None) -> np.ndarray:
+        return self.device.softmax_blocking(scores, lengths, timeout=self.timeout_s)
+
+    def set_tracer(self, tracer) -> None:
+        self.device.set_tracer(tracer)
+
+
+class RemoteBackend(SoftmaxBackend):
+    # Rows go to another process as an .npz body; the reply is the
+    # probabilities as a .npy body.
+    name = "remote"
+
+    def __init__(self, url: str, timeout_s: float = 30.0):
+        self.url = url.rstrip("/") + "/softmax"
+        self.timeout_s = timeout_s
+
+    def softmax(self, scores, lengths=None, *, cache=None, stats=None) -> np.ndarray:
+        x = np.asarray(scores, dtype=np.float32)
+        buf = io.BytesIO()
+        np.savez(buf, scores=x, lengths=_lengths(lengths, *x.shape))
+        req = urllib.request.Request(
+            self.url,
+            data=buf.getvalue(),
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout_s) as resp:
+            out = np.load(io.BytesIO(resp.read()), allow_pickle=False)
+        if out.shape != x.shape:
+            raise RuntimeError(
+                f"remote backend returned {out.shape}, expected {x.shape}"
+            )
+        return out
+
+
+class FallbackBackend(SoftmaxBackend):
+    # Tries each backend in order. One that raises (anything but a
+    # ValueError, which is the caller's fault) is skipped for retry_s and the
+    # rows go to the next; while all are backing off, all are tried. The last
+    # error is raised if every backend fails.
+    name = "fallback"
+
+    def __init__(self, backends: list, retry_s: float = 30.0):
+        if not backends:
+            raise ValueError("backends must not be empty")
+        self.backends = list(backends)
+        self.retry_s = retry_s
+        self.down_until = [0.0] * len(self.backends)
+        self.served = [0] * len(self.backends)
+        self.errors: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def softmax(self, scores, lengths=None, *, cache=None, stats=None) -> np.ndarray:
+        now = time.monotonic()
+        order = [i for i, t in enumerate(self.down_until) if t <= now]
+        err = None
+        for i in order or range(len(self.backends)):
+            b = self.backends[i]
+            try:
+                out = b.softmax(scores, lengths, cache=cache, stats=stats)
+            except ValueError:
+                raise
+            except Exception as e:
+                err = e
+                with self._lock:
+                    self.down_until[i] = time.monotonic() + self.retry_s
+                    self.errors[b.name] = repr(e)
+                print(f"[Warning] Softmax backend {b.name} failed, falling back: {e}")
+                continue
+            with self._lock:
+                self.served[i] += 1
+            return out
+        raise err
+
+    def set_tracer(self, tracer) -> None:
+        for b in self.backends:
+            b.set_tracer(tracer)
+
+    def close(self) -> None:
+        for b in self.backends:
+            b.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                b.name: {"served": n, "down": until > time.monotonic()}
+                for b, n, until in zip(self.backends, self.served, self.down_until)
+            }
+
+
+def _board(arg: str, baud: int = 115200, timeout: float = 1.0, **kw):
+    return SerialBackend(
+        open_serial(arg, baud=baud, timeout=timeout), name=f"board:{arg}", owned=True
+    )
+
+
+def _pool(arg: str, baud: int = 115200, timeout: float = 1.0, **kw):
+    from santa_device import SantaDevicePool
+
+    pool = SantaDevicePool(arg.split(","), baud=baud, timeout=timeout)
+    return SerialBackend(pool, name=f"pool:{arg}", owned=True)
+
+
+BACKENDS = {
+    "fp32": lambda arg, **kw: TorchBackend(),
+    "q610": lambda arg, **kw: TorchApproxBackend(compile=arg == "compile"),
+    "emulator": lambda arg, **kw: SerialBackend(
+        open_serial(EMULATOR_PORT), name="emulator", owned=True
+    ),
+    "board": _board,
+    "pool": _pool,
+    "remote": lambda arg, **kw: RemoteBackend(arg),
+}
+
+
+def register_backend(kind: str, factory) -> None:
+    # factory(arg, **kwargs) -> SoftmaxBackend, for specs "kind" / "kind:arg"
+    BACKENDS[kind] = factory
+
+
+def make_backend(spec, **kwargs) -> SoftmaxBackend:
+    # spec: "fp32", "q610", "emulator", "board:COM3", "pool:COM3,COM4",
+    # "remote:http://host:8000", a backend, or a list of those (fallbacks).
+    if isinstance(spec, SoftmaxBackend):
+        return spec
+    if isinstance(spec, (list, tuple)):
+        if len(spec) == 1:
+            return make_backend(spec[0], **kwargs)
+        return FallbackBackend([make_backend(s, **kwargs) for s in spec])
+    kind, _, arg = str(spec).partition(":")
+    if kind not in BACKENDS:
+        raise ValueError(f"unknown softmax backend {kind!r}; known: {list(BACKENDS)}")
+    return BACKENDS[kind](arg, **kwargs)
+
+
+def as_backend(obj) -> SoftmaxBackend | None:
+    # Lets the older set_serial(ser) / set_device(device) calls keep working.
+    if obj is None or isinstance(obj, SoftmaxBackend):
+        return obj
+    if hasattr(obj, "softmax_blocking"):
+        return DeviceBackend(obj)
+    return SerialBackend(obj)
+
+
+def set_backend_to_model(model, backend) -> None:
+    for module in model.modules():
+        if hasattr(module, "set_backend"):
+            module.set_backend(backend)
+
+
+@contextmanager
+def using_backend(model, backend):
+    # Route one call (or block) of the model to another backend.
+    modules = [m for m in model.modules() if hasattr(m, "set_backend")]
+    saved = [m.backend for m in modules]
+    for m in modules:
+        m.set_backend(backend)
+    try:
+        yield backend
+    finally:
+        for m, b in zip(modules, saved):
+            m.set_backend(b)
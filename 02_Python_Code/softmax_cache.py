@@ -0,0 +1,119 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# The core only ever sees Q6.10 rows, so a quantized row and its length mode
+# fully determine the reply. Keys are a digest of exactly what goes on the
+# wire for one softmax (padded to its mode's capacity), values are the int16
+# probabilities the board returned for it. One cache can be shared by
+# several threads (the demo app's device, fallback and /softmax paths).
+
+DEFAULT_MAX_BYTES = 64 << 20
+KEY_BYTES = 16
+_ENTRY_OVERHEAD = 96
+
+
+class SoftmaxCache:
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, path: str | None = None):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries: OrderedDict[bytes, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @staticmethod
+    def key(row_i16: np.ndarray, len_mode: int) -> bytes:
+        h = hashlib.blake2b(digest_size=KEY_BYTES)
+        h.update(bytes([len_mode & 0x0F]))
+        h.update(np.ascontiguousarray(row_i16, dtype=np.int16).tobytes())
+        return h.digest()
+
+    def get(self, key: bytes) -> np.ndarray | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return np.frombuffer(value, dtype=np.int16)
+
+    def put(self, key: bytes, probs_i16: np.ndarray) -> None:
+        value = np.ascontiguousarray(probs_i16, dtype=np.int16).tobytes()
+        size = len(key) + len(value) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(key) + len(old) + _ENTRY_OVERHEAD
+            self._entries[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                k, v = self._entries.popitem(last=False)
+                self.nbytes -= len(k) + len(v) + _ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def save(self, path: str | None = None) -> None:
+        path = path or self.path
+        if path is None:
+            raise ValueError("No cache path given")
+        # Plain arrays, oldest entry first: the keys, each value's length and
+        # all values back to back.
+        with self._lock:
+            keys = np.frombuffer(b"".join(self._entries), dtype=np.uint8)
+            values = list(self._entries.values())
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                keys=keys.reshape(len(values), KEY_BYTES),
+                lengths=np.array([len(v) // 2 for v in values], dtype=np.int64),
+                values=np.frombuffer(b"".join(values), dtype=np.int16),
+            )
+        os.replace(tmp, path)
+
+    def load(self, path: str | None = None) -> None:
+        path = path or self.path
+        if path is None:
+            raise ValueError("No cache path given")
+        with np.load(path, allow_pickle=False) as z:
+            keys, lengths, values = z["keys"], z["lengths"], z["values"]
+        ends = np.cumsum(lengths)
+        for key, end, n in zip(keys, ends.tolist(), lengths.tolist()):
+            self.put(key.tobytes(), values[end - n : end])
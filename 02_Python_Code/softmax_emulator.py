@@ -0,0 +1,284 @@
+import os
+import numpy as np
+from softmax_batch import BYTES_PER_ROW, SCALE
+
+# Software model of 00_Softmax_Approx_with_Tree (softmax_approx + BRAM_FSM +
+# uart_bram_controller). Every stage works on whole (rows, 64) int arrays.
+# The sub_FX16 / mult_FX16 IP cores are modelled as 16-bit wrapping
+# subtract and 16x16 -> 32-bit signed multiply.
+
+LANES = 64
+LOG2E_Q10 = 0x05C4
+ONE_Q10 = 0x0400
+MAX_INIT = -32768
+SUM_INIT = 0
+
+# stage1_log2_approx: integer part indexed by leading-zero count
+_LOG2_INT_PART = np.array(
+    [-32, 21, 20, 19, 18, 17, 16, 14, 13, 12, 11, 10, 9, 8, 7, 6]
+    + [5, 4, 3, 2, 1, 0, -1, -2, -3, -4, -5, -6, -7, -8, -9, -10],
+    dtype=np.int64,
+)
+
+# stage3_pow2_approx: shift amount indexed by the 6-bit integer part
+_POW2_SHIFT = np.full((64,), 16, dtype=np.int32)
+for _x_int, _shift in zip(range(-10, 6), range(15, -1, -1)):
+    _POW2_SHIFT[_x_int & 0x3F] = _shift
+
+
+def _wrap16(v: np.ndarray) -> np.ndarray:
+    return ((v + 0x8000) & 0xFFFF) - 0x8000
+
+
+def _is_group(len_mode: int) -> bool:
+    return 3 <= len_mode <= 13
+
+
+def log2_approx(x: np.ndarray) -> np.ndarray:
+    u = np.asarray(x, dtype=np.int64) & 0xFFFFFFFF
+    _, bit_len = np.frexp(u.astype(np.float64))
+    zero_cnt = 32 - bit_len.astype(np.int64)
+    zero_cnt[u == 0] = 0
+    frac = ((u << zero_cnt) >> 21) & 0x3FF
+    return _wrap16(_LOG2_INT_PART[zero_cnt] * SCALE + frac)
+
+
+def pow2_approx(y: np.ndarray) -> np.ndarray:
+    y = np.asarray(y)
+    frac = y & 0x3FF
+    shift = _POW2_SHIFT[(y >> 10) & 0x3F]
+    return ((frac | 0x400) << 5) >> shift
+
+
+def RU(in1: np.ndarray, sub_in: np.ndarray, mult: int) -> tuple[np.ndarray, np.ndarray]:
+    diff = _wrap16(np.asarray(in1, dtype=np.int32) - sub_in)
+    y = _wrap16((diff * mult) >> 10)
+    return y, pow2_approx(y)
+
+
+# Both RU passes are pure functions of the 16-bit subtractor output, so the
+# batched path looks them up instead of re-evaluating them per lane.
+_DIFF16 = _wrap16(np.arange(1 << 16, dtype=np.int32))
+_RU1_Y, _RU1_POW = RU(_DIFF16, 0, LOG2E_Q10)
+_RU1_Y = _RU1_Y.astype(np.int16)
+_RU1_POW = _RU1_POW.astype(np.int32)
+_RU3_POW = RU(_DIFF16, 0, ONE_Q10)[1].astype(np.int16)
+
+
+def _sub16(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.subtract(a.view(np.uint16), b.astype(np.uint16))
+
+
+def _tree_reduce(x: np.ndarray, len_mode: np.ndarray, op) -> np.ndarray:
+    # max_tree_64 / adder_tree_64: per-row results for each 16-lane block,
+    # taken from the 16, 32 or 64 level of the tree depending on the mode
+    r16 = op.reduce(x.reshape(-1, 4, 16), axis=2)
+    r32 = op(r16[:, 0::2], r16[:, 1::2])
+    r64 = op(r32[:, 0], r32[:, 1])
+    mode = len_mode[:, None]
+    return np.where(
+        mode == 0, r16, np.where(mode == 1, np.repeat(r32, 2, axis=1), r64[:, None])
+    )
+
+
+def _forwarding(local: np.ndarray, len_mode: np.ndarray, acc: int, init: int, op):
+    # max_forwarding / acc_forwarding: combine the per-row 64-lane result over
+    # groups of (len_mode - 1) consecutive rows. r_cnt restarts at every
+    # transaction while the accumulator is only cleared by a group end or a
+    # non-group row, so it is carried across calls.
+    glob = local.copy()
+    bounds = np.flatnonzero(np.diff(len_mode)) + 1
+    starts = [0, *bounds.tolist()]
+    ends = [*bounds.tolist(), len(len_mode)]
+    cnt = 0
+    for start, end in zip(starts, ends):
+        mode = int(len_mode[start])
+        if not _is_group(mode):
+            cnt, acc = 0, init
+            continue
+        group = mode - 1
+        r = start
+        while r < end:
+            if cnt == 0 and acc == init and end - r >= group:
+                n_full = (end - r) // group * group
+                blk = local[r : r + n_full].reshape(-1, group)
+                glob[r : r + n_full] = np.repeat(op.reduce(blk, axis=1), group)
+                r += n_full
+                continue
+            front = int(op(acc, local[r]))
+            if cnt == group - 1:
+                glob[max(0, r - group + 1) : r + 1] = front
+                cnt, acc = 0, init
+            else:
+                cnt, acc = (cnt + 1) & 0xF, front
+            r += 1
+    return glob, acc
+
+
+class SoftmaxApproxModel:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.max_acc = MAX_INIT
+        self.sum_acc = SUM_INIT
+
+    def run(self, x_i16: np.ndarray, len_mode: np.ndarray) -> np.ndarray:
+        x16 = np.ascontiguousarray(x_i16, dtype=np.int16).reshape(-1, LANES)
+        modes = np.asarray(len_mode, dtype=np.int64).reshape(-1) & 0x0F
+        rows = x16.shape[0]
+        if modes.shape[0] != rows:
+            raise ValueError(f"len_mode must have {rows} entries, got {modes.shape[0]}")
+        if rows == 0:
+            return np.zeros((0, LANES), dtype=np.int16)
+
+        fwd = (modes > 2)[:, None]
+
+        max4 = _tree_reduce(x16, modes, np.maximum)
+        glob_max, self.max_acc = _forwarding(
+            max4[:, 0], modes, self.max_acc, MAX_INIT, np.maximum
+        )
+        max4 = np.where(fwd, glob_max[:, None], max4)
+
+        diff = _sub16(x16.reshape(rows, 4, 16), max4[:, :, None])
+        y = _RU1_Y.take(diff)
+        pow_y = _RU1_POW.take(diff)
+
+        sum4 = _tree_reduce(pow_y, modes, np.add)
+        glob_sum, self.sum_acc = _forwarding(
+            sum4[:, 0], modes, self.sum_acc, SUM_INIT, np.add
+        )
+        sum4 = np.where(fwd, glob_sum[:, None], sum4)
+
+        prob = _RU3_POW.take(_sub16(y, log2_approx(sum4)[:, :, None]))
+        return prob.reshape(rows, LANES)
+
+
+def softmax_approx_q610(x_i16: np.ndarray, len_mode) -> np.ndarray:
+    x = np.asarray(x_i16)
+    modes = np.broadcast_to(np.asarray(len_mode), x.shape[:1])
+    return SoftmaxApproxModel().run(x, modes)
+
+
+def frames_to_rows(frames: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    fr = np.asarray(frames, dtype=np.uint8).reshape(-1, BYTES_PER_ROW)
+    modes = fr[:, 0] & 0x0F
+    x = fr[:, 1:].copy().view(">i2").astype(np.int16)
+    return x, modes
+
+
+def rows_to_frames(probs_i16: np.ndarray) -> np.ndarray:
+    p = np.asarray(probs_i16, dtype=np.int16).reshape(-1, LANES)
+    out = np.zeros((p.shape[0], BYTES_PER_ROW), dtype=np.uint8)
+    out[:, 1:] = p.astype(">i2").view(np.uint8)
+    return out
+
+
+class EmulatedSerial:
+    # Stands in for serial.Serial: speaks the uart_bram_controller protocol
+    # (depth byte, depth+1 rows of 129 bytes, replies with depth+1 rows whose
+    # header nibble is cleared).
+
+    def __init__(self, port: str = "emulator"):
+        self.port = port
+        self.is_open = True
+        self.model = SoftmaxApproxModel()
+        self._rx = bytearray()
+        self._tx = bytearray()
+
+    def _consume(self) -> None:
+        while self._rx:
+            n_rows = self._rx[0] + 1
+            total = 1 + n_rows * BYTES_PER_ROW
+            if len(self._rx) < total:
+                return
+            frames = np.frombuffer(bytes(self._rx[1:total]), dtype=np.uint8)
+            del self._rx[:total]
+            x, modes = frames_to_rows(frames)
+            self._tx += rows_to_frames(self.model.run(x, modes)).tobytes()
+
+    def write(self, data) -> int:
+        if not self.is_open:
+            raise ConnectionError("Serial port is not open.")
+        self._rx += bytes(data)
+        self._consume()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def read(self, size: int = 1) -> bytes:
+        chunk = bytes(self._tx[:size])
+        del self._tx[:size]
+        return chunk
+
+    def readinto(self, buf) -> int:
+        mv = memoryview(buf).cast("B")
+        n = min(len(mv), len(self._tx))
+        mv[:n] = self._tx[:n]
+        del self._tx[:n]
+        return n
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._tx)
+
+    def reset_input_buffer(self) -> None:
+        self._tx.clear()
+
+    def reset_output_buffer(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.is_open = False
+
+
+def load_coe(path: str) -> tuple[np.ndarray, np.ndarray]:
+    with open(path, "r") as f:
+        text = f.read()
+    vector = text.split("memory_initialization_vector", 1)[1].split("=", 1)[1]
+    words = [w.strip() for w in vector.replace(";", ",").split(",") if w.strip()]
+    modes = np.array([int(w[0], 16) for w in words], dtype=np.int64)
+    x = np.vstack([np.frombuffer(bytes.fromhex(w[1:]), dtype=">i2") for w in words])
+    return x.astype(np.int16), modes
+
+
+def load_result(path: str) -> tuple[np.ndarray, np.ndarray]:
+    with open(path, "r") as f:
+        lines = [ln.strip() for ln in f.read().split("\n")]
+    blank = lines.index("")
+    inp, out = lines[:blank], [ln for ln in lines[blank + 1 :] if ln]
+    to_i16 = lambda rows: np.vstack(
+        [np.frombuffer(bytes.fromhex(r), dtype=">i2") for r in rows]
+    ).astype(np.int16)
+    return to_i16(inp), to_i16(out)
+
+
+def verify_against_result(coe_path: str, output_path: str) -> bool:
+    x, modes = load_coe(coe_path)
+    echo, expected = load_result(output_path)
+    if not np.array_equal(x, echo):
+        raise RuntimeError("Output.txt input rows do not match the .coe file")
+
+    got = softmax_approx_q610(x, modes)
+    ok = True
+    for i in range(x.shape[0]):
+        bad = int(np.count_nonzero(got[i] != expected[i]))
+        ok &= bad == 0
+        print(f"[{i:2d}] mode={modes[i]:2d}  lanes mismatched: {bad}")
+    return ok
+
+
+if __name__ == "__main__":
+    result_dir = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "00_Softmax_Approx_with_Tree",
+        "03_Result",
+    )
+    ok = verify_against_result(
+        os.path.join(result_dir, "inite_DATA.coe"),
+        os.path.join(result_dir, "Output.txt"),
+    )
+    print("Bit-exact" if ok else "MISMATCH")
@@ -95,7 +95,7 @@ def main():
                     num_return_sequences=1,
                     do_sample=False,
                     pad_token_id=tokenizer_gpt2.eos_token_id,
-                    use_cache=False,
+                    use_cache=True,
                 )
                 base_time = time.time() - start_t
                 text_base = tokenizer_gpt2.decode(out_base[0], skip_special_tokens=True)
@@ -110,7 +110,7 @@ def main():
                         num_return_sequences=1,
                         do_sample=False,
                         pad_token_id=tokenizer_gpt2.eos_token_id,
-                        use_cache=False,
+                        use_cache=True,
                     )
                     approx_time = time.time() - start_t
                     text_approx = tokenizer_gpt2.decode(
@@ -0,0 +1,184 @@
+import os
+import sys
+import tty
+import time
+import select
+import signal
+import argparse
+import numpy as np
+from softmax_batch import BYTES_PER_ROW
+from softmax_emulator import SoftmaxApproxModel, frames_to_rows, rows_to_frames
+
+# A SANTA board on a Linux / macOS pseudo-terminal. The process owns the
+# master side and speaks the uart_bram_controller protocol (depth byte,
+# depth+1 rows of 129 bytes, reply with depth+1 rows whose header is
+# cleared) on top of the software model of the core. Point open_serial() at
+# the printed path (or --link) to run the real driver end to end:
+#
+#   python virtual_board.py --baud 115200 --link /tmp/santa
+#   ser = open_serial("/tmp/santa", baud=115200)
+#
+# With --baud the request is not answered before it could have arrived over
+# a link at that rate, the core takes --core-latency-us per row, and the
+# reply is paced out at the same rate. Like the RTL, the board ignores rx
+# from the last request byte until the last reply byte is out.
+
+PACE_CHUNK_S = 0.002
+
+
+class VirtualBoard:
+
+    def __init__(
+        self,
+        baud: int | None = None,
+        core_latency_s: float | np.ndarray = 0.0,
+        link: str | None = None,
+    ):
+        self.baud = baud
+        self.byte_time = 10.0 / baud if baud else 0.0
+        self.core_latency_s = np.broadcast_to(
+            np.asarray(core_latency_s, dtype=np.float64), (16,)
+        )
+        self.link = link
+        self.model = SoftmaxApproxModel()
+        self.transactions = 0
+        self.rows = 0
+        self.dropped = 0
+        self._rx = bytearray()
+        self._rx_start = 0.0
+        self._master = None
+        self._slave = None
+        self.path = None
+
+    def open(self) -> str:
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        if self.link:
+            if os.path.lexists(self.link):
+                os.remove(self.link)
+            os.symlink(self.path, self.link)
+        return self.link or self.path
+
+    def close(self) -> None:
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def _sleep_until(self, t: float) -> None:
+        dt = t - time.perf_counter()
+        if dt > 0:
+            time.sleep(dt)
+
+    def _send(self, data: bytes) -> None:
+        # rx is ignored until the last reply byte is out: whatever came in
+        # before it is dropped, anything after it starts the next request.
+        head, last = data[:-1], data[-1:]
+        if not self.byte_time:
+            os.write(self._master, head)
+        else:
+            chunk = max(1, int(PACE_CHUNK_S / self.byte_time))
+            t0 = time.perf_counter()
+            for i in range(0, len(head), chunk):
+                self._sleep_until(t0 + i * self.byte_time)
+                os.write(self._master, head[i : i + chunk])
+            self._sleep_until(t0 + len(head) * self.byte_time)
+        self.dropped += self._discard_input()
+        os.write(self._master, last)
+
+    def _discard_input(self) -> int:
+        n = 0
+        while select.select([self._master], [], [], 0)[0]:
+            try:
+                data = os.read(self._master, 1 << 16)
+            except OSError:
+                break
+            if not data:
+                break
+            n += len(data)
+        return n
+
+    def _consume(self, now: float) -> None:
+        # uart_bram_controller: IDLE -> depth byte -> depth+1 rows -> compute
+        # (S_CORE_*) -> send rows (S_TX_*) -> IDLE. rx is not sampled in the
+        # compute and send states, so bytes behind a complete request and
+        # bytes arriving before the last reply byte are lost.
+        n_rows = self._rx[0] + 1
+        total = 1 + n_rows * BYTES_PER_ROW
+        if len(self._rx) < total:
+            return
+        frames = np.frombuffer(bytes(self._rx[1:total]), dtype=np.uint8)
+        self.dropped += len(self._rx) - total
+        self._rx.clear()
+
+        arrived = max(now, self._rx_start + total * self.byte_time)
+        self._sleep_until(arrived)
+        x, modes = frames_to_rows(frames)
+        reply = rows_to_frames(self.model.run(x, modes)).tobytes()
+        self._sleep_until(arrived + self.core_latency_s[modes].sum())
+        self._send(reply)
+
+        self.transactions += 1
+        self.rows += n_rows
+
+    def serve_forever(self, poll_s: float = 0.1) -> None:
+        while True:
+            ready, _, _ = select.select([self._master], [], [], poll_s)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._master, 1 << 16)
+            except OSError:
+                # No process has the slave open (and ours was closed).
+                return
+            if not data:
+                return
+            now = time.perf_counter()
+            if not self._rx:
+                self._rx_start = now
+            self._rx += data
+            self._consume(now)
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Virtual SANTA board on a pty")
+    p.add_argument("--baud", type=int, help="throttle to this line rate")
+    p.add_argument(
+        "--core-latency-us",
+        type=float,
+        nargs="+",
+        default=[0.0],
+        help="core time per row: one value, or 16 values indexed by mode",
+    )
+    p.add_argument("--link", help="symlink to create for the pty path")
+    args = p.parse_args(argv)
+    if len(args.core_latency_us) not in (1, 16):
+        p.error("--core-latency-us takes 1 or 16 values")
+
+    board = VirtualBoard(
+        baud=args.baud,
+        core_latency_s=np.asarray(args.core_latency_us) * 1e-6,
+        link=args.link,
+    )
+    path = board.open()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"[VirtualBoard] Listening on {path}", flush=True)
+    try:
+        board.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        board.close()
+        print(
+            f"[VirtualBoard] {board.transactions} transactions, {board.rows} rows, "
+            f"{board.dropped} bytes dropped while busy",
+            flush=True,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
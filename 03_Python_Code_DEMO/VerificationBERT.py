@@ -5,19 +5,37 @@ import numpy as np
 import datasets
 from transformers import BertTokenizer, BertForSequenceClassification
 from transformers.models.bert.modeling_bert import BertSelfAttention
-from attention_approx import attention
-from softmax_batch import open_serial, close_serial
+from attention_approx import attention_batched, attention_batched_torch
+from softmax_batch import close_serial
+from softmax_cache import SoftmaxCache
+from santa_device import AsyncSantaDevice, open_device
+from softmax_backend import SoftmaxBackend, as_backend
+from santa_trace import Tracer, span
 
 
 class BertSelfAttentionSoftmaxApprox(BertSelfAttention):
 
     def __init__(self, config, position_embedding_type=None):
         super().__init__(config, position_embedding_type=position_embedding_type)
-        self.ser = None
+        self.backend: Optional[SoftmaxBackend] = None
+        self.cache: Optional[SoftmaxCache] = None
+        self.tracer: Optional[Tracer] = None
         self.last_attn: Optional[np.ndarray] = None
 
+    def set_backend(self, backend):
+        self.backend = as_backend(backend)
+
     def set_serial(self, ser):
-        self.ser = ser
+        self.set_backend(ser)
+
+    def set_cache(self, cache: Optional[SoftmaxCache]):
+        self.cache = cache
+
+    def set_device(self, device: Optional[AsyncSantaDevice]):
+        self.set_backend(device)
+
+    def set_tracer(self, tracer: Optional[Tracer]):
+        self.tracer = tracer
 
     def forward(
         self,
@@ -31,15 +49,11 @@ class BertSelfAttentionSoftmaxApprox(BertSelfAttention):
         **kwargs,
     ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
 
-        if self.ser is None:
+        if self.backend is None:
             raise RuntimeError(
-                "UART serial is not set. Call set_serial(ser) before forward()."
+                "Softmax backend is not set. Call set_backend() before forward()."
             )
 
-        mixed_query_layer = self.query(hidden_states)
-        mixed_key_layer = self.key(hidden_states)
-        mixed_value_layer = self.value(hidden_states)
-
         def shape(x: torch.Tensor) -> torch.Tensor:
             return x.view(
                 x.size(0),
@@ -48,35 +62,50 @@ class BertSelfAttentionSoftmaxApprox(BertSelfAttention):
                 self.attention_head_size,
             ).transpose(1, 2)
 
-        query_layer = shape(mixed_query_layer)
-        key_layer = shape(mixed_key_layer)
-        value_layer = shape(mixed_value_layer)
+        with span(self.tracer, "Q/K/V projection"):
+            query_layer = shape(self.query(hidden_states))
+            key_layer = shape(self.key(hidden_states))
+            value_layer = shape(self.value(hidden_states))
 
         B, H, T, Dh = query_layer.shape
-        out = torch.zeros_like(query_layer)
 
-        mask_np = None
+        # Additive mask is (B, 1, 1, T) or (B, 1, T, T); a key is live where
+        # it is 0. Padded keys and queries are dropped before the hardware
+        # call, padded query rows come back as zeros.
+        live = torch.ones((B, T), dtype=torch.bool, device=query_layer.device)
         if attention_mask is not None:
-            mask = attention_mask.squeeze(1).squeeze(1)
-            mask_np = mask.detach().cpu().numpy()
+            mask = attention_mask[:, 0].amax(dim=-2)
+            live = mask == 0
 
         if output_attentions:
             self.last_attn = np.zeros((B, H, T, T), dtype=np.float64)
         else:
             self.last_attn = None
 
-        for b in range(B):
-            for h in range(H):
-                Q_np = query_layer[b, h].detach().cpu().numpy()
-                K_np = key_layer[b, h].detach().cpu().numpy()
-                V_np = value_layer[b, h].detach().cpu().numpy()
-
-                out_np = attention(
-                    Q_np, K_np, V_np, self.ser, pad_value=-32.0, timeout_s=2.0
-                )
-                out[b, h] = torch.tensor(
-                    out_np, dtype=query_layer.dtype, device=query_layer.device
-                )
+        # Backends that work on tensors (fp32, q610) get the whole layer as
+        # one call; the rest get NumPy rows.
+        if hasattr(self.backend, "softmax_tensor"):
+            out = attention_batched_torch(
+                query_layer,
+                key_layer,
+                value_layer,
+                self.backend,
+                live=live,
+                tracer=self.tracer,
+            )
+        else:
+            out_np = attention_batched(
+                query_layer.detach().cpu().numpy(),
+                key_layer.detach().cpu().numpy(),
+                value_layer.detach().cpu().numpy(),
+                self.backend,
+                live=live.detach().cpu().numpy(),
+                cache=self.cache,
+                tracer=self.tracer,
+            )
+            out = torch.from_numpy(out_np).to(
+                dtype=query_layer.dtype, device=query_layer.device
+            )
 
         context_layer = out.transpose(1, 2).contiguous().view(B, T, H * Dh)
         return context_layer, None
@@ -90,11 +119,15 @@ def replace_self_attention(model: BertForSequenceClassification, NewSAClass):
         layer.attention.self = new_sa
 
 
-def set_serial_to_model(model: BertForSequenceClassification, ser):
+def set_serial_to_model(
+    model: BertForSequenceClassification, ser, cache: Optional[SoftmaxCache] = None
+):
     for layer in model.bert.encoder.layer:
         sa = layer.attention.self
         if hasattr(sa, "set_serial"):
             sa.set_serial(ser)
+        if hasattr(sa, "set_cache"):
+            sa.set_cache(cache)
 
 
 def get_last_attention_matrix(model, layer=0, head=0):
@@ -112,7 +145,7 @@ def get_last_attention_matrix(model, layer=0, head=0):
     return attn[0, head]
 
 
-def build_model_BERT(ser: serial.Serial):
+def build_model_BERT(ser: serial.Serial, cache: Optional[SoftmaxCache] = None):
     device = "cpu"
 
     print(f"Loading BERT model for SST-2...")
@@ -132,13 +165,13 @@ def build_model_BERT(ser: serial.Serial):
         .eval()
     )
     replace_self_attention(approx_model, BertSelfAttentionSoftmaxApprox)
-    set_serial_to_model(approx_model, ser)
+    set_serial_to_model(approx_model, ser, cache)
 
     return tokenizer, baseline_model, approx_model, device
 
 
-def evaluate_SST2():
-    ser = open_serial("COM3", baud=115200, timeout=1.0)
+def evaluate_SST2(batch_size: int = 1, ports=("COM3",)):
+    ser = open_device(list(ports), baud=115200, timeout=1.0)
     dataset = datasets.load_dataset("glue", "sst2", split="validation")
     tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
 
@@ -158,32 +191,39 @@ def evaluate_SST2():
 
     lengths = []
 
-    for i, item in enumerate(dataset):
-        inputs = tokenizer(item["sentence"], return_tensors="pt", truncation=True)
-        label = item["label"]
+    for start in range(0, len(dataset), batch_size):
+        batch = dataset[start : start + batch_size]
+        inputs = tokenizer(
+            batch["sentence"], return_tensors="pt", truncation=True, padding=True
+        )
+        labels = batch["label"]
 
-        L = inputs["input_ids"].shape[-1]
-        lengths.append(L)
+        batch_lengths = inputs["attention_mask"].sum(dim=-1).tolist()
+        lengths.extend(batch_lengths)
 
         with torch.no_grad():
             out_base = baseline_model(**inputs).logits
             out_approx = approx_model(**inputs).logits
 
-        pred_base = out_base.argmax(dim=-1).item()
-        pred_approx = out_approx.argmax(dim=-1).item()
+        preds_base = out_base.argmax(dim=-1).tolist()
+        preds_approx = out_approx.argmax(dim=-1).tolist()
 
-        if pred_base == label:
-            correct_baseline += 1
-        if pred_approx == label:
-            correct_approx += 1
-        if pred_base == pred_approx:
-            match_count_approx += 1
+        for j, (L, pred_base, pred_approx, label) in enumerate(
+            zip(batch_lengths, preds_base, preds_approx, labels)
+        ):
+            i = start + j
+            if pred_base == label:
+                correct_baseline += 1
+            if pred_approx == label:
+                correct_approx += 1
+            if pred_base == pred_approx:
+                match_count_approx += 1
 
-        same_approx = "O" if pred_base == pred_approx else "X"
+            same_approx = "O" if pred_base == pred_approx else "X"
 
-        print(
-            f"[{i:3d}] L={L:3d}  Base:{pred_base}  Approx:{pred_approx}  Label:{label}  Match {same_approx}"
-        )
+            print(
+                f"[{i:3d}] L={L:3d}  Base:{pred_base}  Approx:{pred_approx}  Label:{label}  Match {same_approx}"
+            )
 
     total = len(dataset)
     print("\nEvaluation Results :")
@@ -13,24 +13,37 @@ from matplotlib import colors as mcolors
 from matplotlib.colors import LinearSegmentedColormap, ListedColormap, BoundaryNorm
 
 from fastapi import FastAPI, Form, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, StreamingResponse, RedirectResponse
+from fastapi.responses import (
+    HTMLResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+    RedirectResponse,
+)
 from fastapi.staticfiles import StaticFiles
 
 import ui_main_page
 import ui_gpt_page as ui_gpt
 import ui_bert_page
 from softmax_batch import open_serial, close_serial
+from softmax_cache import SoftmaxCache
+from santa_device import AsyncSantaDevice
+from softmax_backend import DeviceBackend, FallbackBackend, make_backend
+from santa_stats import format_metric, cache_metrics
 from VerificationBERT import build_model_BERT, get_last_attention_matrix
 from VerificationGPT2 import build_model_GPT2, get_last_gpt2_attention_matrix
 
 SERIAL_PORT = "COM3"
 BAUD_RATE = 115200
 TIMEOUT = 1.0
+SOFTMAX_CACHE_PATH = "softmax_cache.npz"
 
 models = {}
 ATTN_STORE = {}
 CACHE_STORE = {}
-hardware_lock = asyncio.Lock()
+# Held per model around anything that touches its modules' shared state
+# (callbacks, last_attn); the board itself is shared through AsyncSantaDevice.
+model_locks = {"bert": asyncio.Lock(), "gpt2": asyncio.Lock()}
 
 
 @contextlib.asynccontextmanager
@@ -42,21 +55,45 @@ async def lifespan(app: FastAPI):
         print(f"[System] Serial port {SERIAL_PORT} connected successfully.")
     except Exception as e:
         print(f"[Warning] Failed to open serial port: {e}")
-        print("[System] Starting in SOFTWARE ONLY mode.")
+        print("[System] Starting in SOFTWARE ONLY mode (Q6.10 emulator).")
         ser = None
 
+    softmax_cache = SoftmaxCache(path=SOFTMAX_CACHE_PATH)
+    print(f"[System] Softmax cache: {len(softmax_cache)} entries loaded.")
+
+    # Without a board (or once it fails) the approximate models run on the
+    # Q6.10 emulator, which gives the board's results bit for bit.
+    santa = None
+    emulator = make_backend("emulator")
+    if ser is not None:
+        santa = await AsyncSantaDevice(ser, cache=softmax_cache).start()
+        backend = FallbackBackend([DeviceBackend(santa), emulator])
+    else:
+        backend = emulator
+
     print("[System] Building BERT model...")
-    tok_bert, base_bert, approx_bert, dev_bert = build_model_BERT(ser)
+    tok_bert, base_bert, approx_bert, dev_bert = build_model_BERT(
+        backend, softmax_cache
+    )
 
     print("[System] Building GPT-2 model...")
-    tok_gpt2, base_gpt2, approx_gpt2, dev_gpt2 = build_model_GPT2(ser)
+    tok_gpt2, base_gpt2, approx_gpt2, dev_gpt2 = build_model_GPT2(
+        backend, softmax_cache
+    )
 
     models["ser"] = ser
+    models["santa"] = santa
+    models["backend"] = backend
+    models["softmax_cache"] = softmax_cache
     models["bert"] = (tok_bert, base_bert, approx_bert, dev_bert)
     models["gpt2"] = (tok_gpt2, base_gpt2, approx_gpt2, dev_gpt2)
 
     print("[System] All models loaded and ready!")
     yield
+    if santa is not None:
+        await santa.close()
+    emulator.close()
+    softmax_cache.save()
     if models.get("ser"):
         print("[System] Closing serial port...")
         close_serial(models["ser"])
@@ -66,6 +103,64 @@ app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text format. Without a board only the cache is reported.
+    santa = models.get("santa")
+    if santa is not None:
+        text = santa.prometheus()
+    else:
+        lines = format_metric("santa_up", "gauge", "Board attached.", [({}, 0)])
+        if models.get("softmax_cache") is not None:
+            lines += cache_metrics(models["softmax_cache"])
+        text = "\n".join(lines) + "\n"
+    backend = models.get("backend")
+    if isinstance(backend, FallbackBackend):
+        served = backend.stats()
+        lines = format_metric(
+            "santa_backend_requests_total",
+            "counter",
+            "Softmax calls served per backend.",
+            [({"backend": b}, s["served"]) for b, s in served.items()],
+        )
+        lines += format_metric(
+            "santa_backend_up",
+            "gauge",
+            "Backend not in its failure back-off.",
+            [({"backend": b}, int(not s["down"])) for b, s in served.items()],
+        )
+        text += "\n".join(lines) + "\n"
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+@app.post("/softmax")
+async def softmax_rows(request: Request):
+    # Remote softmax backend: an .npz body with scores (N, L) and lengths
+    # (N,), answered with the probabilities as .npy.
+    # A body that does not decode, or rows the backend rejects (ValueError),
+    # is the caller's fault; any other backend failure means no softmax
+    # backend is available right now.
+    try:
+        with np.load(io.BytesIO(await request.body()), allow_pickle=False) as z:
+            scores, lengths = z["scores"], z["lengths"]
+    except Exception as e:
+        return PlainTextResponse(f"Bad softmax request: {e}", status_code=400)
+    try:
+        probs = await asyncio.to_thread(
+            models["backend"].softmax,
+            scores,
+            lengths,
+            cache=models["softmax_cache"],
+        )
+    except ValueError as e:
+        return PlainTextResponse(f"Bad softmax request: {e}", status_code=400)
+    except Exception as e:
+        return PlainTextResponse(f"Softmax backend failed: {e}", status_code=503)
+    buf = io.BytesIO()
+    np.save(buf, probs)
+    return Response(buf.getvalue(), media_type="application/octet-stream")
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     return RedirectResponse(url="/attention_ui")
@@ -99,64 +194,81 @@ async def websocket_generate(websocket: WebSocket):
     await websocket.accept()
 
     try:
+        # Wait for the prompt before taking the model, so an idle socket does
+        # not block every other GPT-2 request.
         data = await websocket.receive_json()
         text = data.get("text", "")
         cache_id = data.get("cache_id", None)
         layer = int(data.get("layer", 0))
         head = int(data.get("head", 0))
 
-        tokenizer, _, approx_model, device = models["gpt2"]
-        loop = asyncio.get_event_loop()
+        async with model_locks["gpt2"]:
+            tokenizer, _, approx_model, device = models["gpt2"]
+            try:
+                loop = asyncio.get_event_loop()
+
+                def sync_callback(matrix, layer_idx, head_idx):
+                    async def async_send():
+                        try:
+                            b64_img = await asyncio.to_thread(
+                                plot_to_base64, matrix, layer_idx, head_idx
+                            )
+                            await websocket.send_json(
+                                {"type": "image", "data": b64_img}
+                            )
+                        except Exception:
+                            pass
+
+                    asyncio.run_coroutine_threadsafe(async_send(), loop)
+
+                for module in approx_model.modules():
+                    if hasattr(module, "set_callback"):
+                        module.set_callback(sync_callback)
+
+                await websocket.send_json(
+                    {"type": "log", "data": "Hardware Initialized..."}
+                )
 
-        def sync_callback(matrix, layer_idx, head_idx):
-            async def async_send():
-                try:
-                    b64_img = await asyncio.to_thread(
-                        plot_to_base64, matrix, layer_idx, head_idx
+                def run_generation_task():
+                    input_ids = tokenizer.encode(text, return_tensors="pt").to(device)
+                    attention_mask = torch.ones_like(input_ids).to(device)
+
+                    output_tokens = approx_model.generate(
+                        input_ids,
+                        attention_mask=attention_mask,
+                        max_new_tokens=5,
+                        do_sample=False,
+                        pad_token_id=tokenizer.eos_token_id,
+                        use_cache=True,
                     )
-                    await websocket.send_json({"type": "image", "data": b64_img})
-                except Exception:
-                    pass
-
-            asyncio.run_coroutine_threadsafe(async_send(), loop)
-
-        for module in approx_model.modules():
-            if hasattr(module, "set_callback"):
-                module.set_callback(sync_callback)
-
-        await websocket.send_json({"type": "log", "data": "Hardware Initialized..."})
-
-        def run_generation_task():
-            input_ids = tokenizer.encode(text, return_tensors="pt").to(device)
-            attention_mask = torch.ones_like(input_ids).to(device)
 
-            output_tokens = approx_model.generate(
-                input_ids,
-                attention_mask=attention_mask,
-                max_new_tokens=5,
-                do_sample=False,
-                pad_token_id=tokenizer.eos_token_id,
-                use_cache=False,
-            )
+                    hw_text = tokenizer.decode(
+                        output_tokens[0], skip_special_tokens=True
+                    )
 
-            hw_text = tokenizer.decode(output_tokens[0], skip_special_tokens=True)
+                    real_attn = get_last_gpt2_attention_matrix(
+                        approx_model, layer=layer, head=head
+                    )
 
-            real_attn = get_last_gpt2_attention_matrix(
-                approx_model, layer=layer, head=head
-            )
+                    return hw_text, output_tokens[0], real_attn
 
-            return hw_text, output_tokens[0], real_attn
+                result = await asyncio.to_thread(run_generation_task)
+                hw_text, tokens_tensor, real_attn = result
 
-        result = await asyncio.to_thread(run_generation_task)
-        hw_text, tokens_tensor, real_attn = result
+                if cache_id:
+                    CACHE_STORE[cache_id] = {
+                        "hw_text": hw_text,
+                        "tokens": [
+                            tokenizer.decode([t]).strip() for t in tokens_tensor
+                        ],
+                        "real_attn": real_attn,
+                    }
+                    print(f"[Cache] Saved result for ID: {cache_id}")
 
-        if cache_id:
-            CACHE_STORE[cache_id] = {
-                "hw_text": hw_text,
-                "tokens": [tokenizer.decode([t]).strip() for t in tokens_tensor],
-                "real_attn": real_attn,
-            }
-            print(f"[Cache] Saved result for ID: {cache_id}")
+            finally:
+                for module in approx_model.modules():
+                    if hasattr(module, "set_callback"):
+                        module.set_callback(None)
 
         await websocket.send_json({"type": "done"})
 
@@ -165,11 +277,6 @@ async def websocket_generate(websocket: WebSocket):
     except Exception as e:
         print(f"[WS] Error: {e}")
         await websocket.send_json({"type": "error", "msg": str(e)})
-    finally:
-        tokenizer, _, approx_model, device = models["gpt2"]
-        for module in approx_model.modules():
-            if hasattr(module, "set_callback"):
-                module.set_callback(None)
 
 
 @app.post("/attention_generate", response_class=HTMLResponse)
@@ -185,13 +292,18 @@ async def attention_generate(
     if "bert" not in models and "gpt2" not in models:
         return HTMLResponse("<h1>Error: Models initialization failed.</h1>")
 
-    async with hardware_lock:
-        if model == "bert":
-            return process_bert(text, mode, layer, head, max_len)
-        elif model == "gpt":
-            return process_gpt(text, mode, layer, head, cache_id)
-        else:
-            return HTMLResponse(f"<h1>Error: Unknown model '{model}'</h1>")
+    if model == "bert":
+        async with model_locks["bert"]:
+            return await asyncio.to_thread(
+                process_bert, text, mode, layer, head, max_len
+            )
+    elif model == "gpt":
+        async with model_locks["gpt2"]:
+            return await asyncio.to_thread(
+                process_gpt, text, mode, layer, head, cache_id
+            )
+    else:
+        return HTMLResponse(f"<h1>Error: Unknown model '{model}'</h1>")
 
 
 def process_bert(text, mode, layer, head, max_len):
@@ -310,7 +422,7 @@ def process_gpt(text, mode, layer, head, cache_id=None):
                     max_new_tokens=5,
                     do_sample=False,
                     pad_token_id=tokenizer.eos_token_id,
-                    use_cache=False,
+                    use_cache=True,
                 )
                 hw_text = tokenizer.decode(out_approx[0], skip_special_tokens=True)
                 real_attn = get_last_gpt2_attention_matrix(
@@ -1,6 +1,9 @@
 import numpy as np
+import torch
 import serial
-from softmax_batch import softmax_batch
+from softmax_batch import HW_softmax_2d
+from softmax_backend import as_backend
+from santa_trace import span
 
 
 def attention(
@@ -33,18 +36,107 @@ def attention(
 
     S = (K @ Q.T) / np.sqrt(d_k)
 
-    seqs = [S[:, j].astype(np.float32, copy=False) for j in range(Nq)]
-
-    probs_list = softmax_batch(
+    P = HW_softmax_2d(
         ser,
-        seqs,
+        S.T,
         pad_value=pad_value,
         timeout_s=timeout_s,
+        pipelined=True,
     )
-
-    P = np.vstack([np.asarray(p, dtype=np.float64) for p in probs_list])
     if P.shape != (Nq, Nk):
-        raise RuntimeError(f"softmax_batch returned {P.shape}, expected {(Nq, Nk)}")
+        raise RuntimeError(f"HW_softmax_2d returned {P.shape}, expected {(Nq, Nk)}")
 
     out = P @ V
     return out
+
+
+def attention_batched(
+    Q,
+    K,
+    V,
+    backend,
+    *,
+    live: np.ndarray | None = None,
+    cache=None,
+    tracer=None,
+) -> np.ndarray:
+
+    Q = np.asarray(Q, dtype=np.float32)
+    K = np.asarray(K, dtype=np.float32)
+    V = np.asarray(V, dtype=np.float32)
+
+    if Q.ndim != 4 or K.ndim != 4 or V.ndim != 4:
+        raise ValueError("Q, K, V must be 4D arrays (B, H, T, D)")
+    if Q.shape[:3] != K.shape[:3] or K.shape[:3] != V.shape[:3]:
+        raise ValueError(f"Dim mismatch: Q{Q.shape}, K{K.shape}, V{V.shape}")
+    if Q.shape[-1] != K.shape[-1]:
+        raise ValueError(f"Dim mismatch: Q{Q.shape}, K{K.shape}")
+
+    B, H, T, d_k = Q.shape
+    if live is None:
+        live = np.ones((B, T), dtype=bool)
+    live = np.asarray(live, dtype=bool)
+    if live.shape != (B, T):
+        raise ValueError(f"live must have shape {(B, T)}, got {live.shape}")
+
+    # Move each sample's live tokens to the front so every query row is a
+    # prefix of length n[b]; padded query rows are never sent.
+    with span(tracer, "score matmul"):
+        perm = np.argsort(~live, axis=1, kind="stable")
+        n = live.sum(axis=1)
+        gather = perm[:, None, :, None]
+        Qp = np.take_along_axis(Q, gather, axis=2)
+        Kp = np.take_along_axis(K, gather, axis=2)
+        Vp = np.take_along_axis(V, gather, axis=2)
+
+        S = np.matmul(Qp, Kp.transpose(0, 1, 3, 2)) / np.float32(np.sqrt(d_k))
+
+    q_live = np.broadcast_to((np.arange(T) < n[:, None])[:, None, :], (B, H, T))
+    lengths = np.broadcast_to(n[:, None, None], (B, H, T))[q_live]
+
+    P = np.zeros((B, H, T, T), dtype=np.float32)
+    with span(tracer, "softmax", rows=len(lengths)):
+        P[q_live] = as_backend(backend).softmax(
+            S[q_live], lengths, cache=cache, stats=tracer
+        )
+
+    with span(tracer, "P@V"):
+        out = np.empty((B, H, T, V.shape[-1]), dtype=np.float32)
+        np.put_along_axis(out, gather, np.matmul(P, Vp), axis=2)
+    return out
+
+
+def attention_batched_torch(
+    Q: torch.Tensor,
+    K: torch.Tensor,
+    V: torch.Tensor,
+    backend,
+    *,
+    live: torch.Tensor | None = None,
+    tracer=None,
+) -> torch.Tensor:
+    # attention_batched for backends with softmax_tensor(): same live-prefix
+    # layout, but the (B, H, T, T) scores go to the backend in one call and
+    # never leave torch.
+    B, H, T, d_k = Q.shape
+    if live is None:
+        live = torch.ones((B, T), dtype=torch.bool, device=Q.device)
+
+    with span(tracer, "score matmul"):
+        perm = torch.argsort((~live).to(torch.int8), dim=1, stable=True)
+        n = live.sum(dim=1)
+        gather = perm[:, None, :, None]
+        Qp = torch.take_along_dim(Q, gather, dim=2)
+        Kp = torch.take_along_dim(K, gather, dim=2)
+        Vp = torch.take_along_dim(V, gather, dim=2)
+        S = torch.matmul(Qp, Kp.transpose(-1, -2)) / (d_k**0.5)
+
+    with span(tracer, "softmax", rows=B * H * T):
+        P = backend.softmax_tensor(S, n[:, None, None])
+        q_live = torch.arange(T, device=Q.device) < n[:, None]
+        P = P * q_live[:, None, :, None]
+
+    with span(tracer, "P@V"):
+        out = torch.empty((B, H, T, V.shape[-1]), dtype=V.dtype, device=V.device)
+        out.scatter_(2, gather.expand(-1, H, -1, V.shape[-1]), torch.matmul(P, Vp))
+    return out
@@ -0,0 +1,250 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+import numpy as np
+
+# Where the time goes in the UART driver. One SantaStats is shared by every
+# thread talking to a board (or a pool of boards) and is passed down the
+# softmax calls like the cache. Stages of one softmax call:
+#   pack         quantize + frame the rows that are not cached
+#   send         send_frame(), until the request has been flushed
+#   wait         flush -> first reply byte (wire + core compute)
+#   recv         first reply byte -> last reply byte
+#   transaction  one whole _transact(), including any retries
+#   decode       unpack the replies and write the probabilities back
+#   dispatch     one whole softmax call as seen by the caller
+
+STAGES = ("pack", "send", "wait", "recv", "transaction", "decode", "dispatch")
+TIME_BUCKETS_S = (
+    50e-6,
+    100e-6,
+    250e-6,
+    500e-6,
+    1e-3,
+    2.5e-3,
+    5e-3,
+    10e-3,
+    25e-3,
+    50e-3,
+    100e-3,
+    250e-3,
+    500e-3,
+    1.0,
+    2.5,
+    5.0,
+)
+ROW_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 96, 128)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.50),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip(self.buckets, np.cumsum(self.counts[:-1]).tolist())),
+        }
+
+
+def format_metric(name: str, kind: str, help_text: str, samples) -> list[str]:
+    # samples: (labels dict, value) pairs, or Histogram objects keyed by labels
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if isinstance(value, Histogram):
+            cum = 0
+            for bound, n in zip(value.buckets + (float("inf"),), value.counts):
+                cum += n
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {cum}")
+            lines.append(f"{name}_sum{_labels(labels)} {value.sum!r}")
+            lines.append(f"{name}_count{_labels(labels)} {value.count}")
+        else:
+            lines.append(f"{name}{_labels(labels)} {value}")
+    return lines
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def cache_metrics(cache, prefix: str = "santa") -> list[str]:
+    s = cache.stats()
+    return [
+        *format_metric(
+            f"{prefix}_cache_lookups_total",
+            "counter",
+            "Softmax cache lookups.",
+            [({"result": "hit"}, s["hits"]), ({"result": "miss"}, s["misses"])],
+        ),
+        *format_metric(
+            f"{prefix}_cache_evictions_total",
+            "counter",
+            "Softmax cache evictions.",
+            [({}, s["evictions"])],
+        ),
+        *format_metric(
+            f"{prefix}_cache_entries",
+            "gauge",
+            "Softmax cache entries.",
+            [({}, len(cache))],
+        ),
+        *format_metric(
+            f"{prefix}_cache_bytes", "gauge", "Softmax cache size.", [({}, s["bytes"])]
+        ),
+    ]
+
+
+class SantaStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.timings = {stage: Histogram(TIME_BUCKETS_S) for stage in STAGES}
+            self.tx_rows = Histogram(ROW_BUCKETS)
+            self.transactions = 0
+            self.retries = {"timeout": 0, "corrupt": 0}
+            self.bytes_tx = 0
+            self.bytes_rx = 0
+            self.rows_by_mode = [0] * 16
+            self.lanes_used = 0
+            self.lanes_sent = 0
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.timings[stage].observe(seconds)
+
+    @contextmanager
+    def timed(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def record_transaction(
+        self,
+        tx: np.ndarray,
+        send_s: float,
+        wait_s: float,
+        recv_s: float,
+        total_s: float,
+    ) -> None:
+        rows = tx.shape[0]
+        modes = np.bincount(tx[:, 0] & 0x0F, minlength=16)
+        with self._lock:
+            self.transactions += 1
+            self.bytes_tx += 1 + tx.size
+            self.bytes_rx += tx.size
+            for m in np.flatnonzero(modes).tolist():
+                self.rows_by_mode[m] += int(modes[m])
+            self.tx_rows.observe(rows)
+            self.timings["send"].observe(send_s)
+            self.timings["wait"].observe(wait_s)
+            self.timings["recv"].observe(recv_s)
+            self.timings["transaction"].observe(total_s)
+
+    def record_retry(self, reason: str) -> None:
+        with self._lock:
+            self.retries[reason] += 1
+
+    def record_lanes(self, used: int, sent: int) -> None:
+        with self._lock:
+            self.lanes_used += used
+            self.lanes_sent += sent
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            padded = self.lanes_sent - self.lanes_used
+            return {
+                "transactions": self.transactions,
+                "retries": dict(self.retries),
+                "bytes_tx": self.bytes_tx,
+                "bytes_rx": self.bytes_rx,
+                "rows_by_mode": {m: n for m, n in enumerate(self.rows_by_mode) if n},
+                "lanes_used": self.lanes_used,
+                "lanes_padded": padded,
+                "padding_ratio": padded / self.lanes_sent if self.lanes_sent else 0.0,
+                "rows_per_transaction": self.tx_rows.snapshot(),
+                "timings": {s: h.snapshot() for s, h in self.timings.items()},
+            }
+
+    def prometheus_lines(self, prefix: str = "santa") -> list[str]:
+        with self._lock:
+            return [
+                *format_metric(
+                    f"{prefix}_stage_seconds",
+                    "histogram",
+                    "Time spent per driver stage.",
+                    [({"stage": s}, h) for s, h in self.timings.items()],
+                ),
+                *format_metric(
+                    f"{prefix}_transaction_rows",
+                    "histogram",
+                    "Rows per UART transaction.",
+                    [({}, self.tx_rows)],
+                ),
+                *format_metric(
+                    f"{prefix}_transactions_total",
+                    "counter",
+                    "Completed UART transactions.",
+                    [({}, self.transactions)],
+                ),
+                *format_metric(
+                    f"{prefix}_retries_total",
+                    "counter",
+                    "Transactions resent after a resync.",
+                    [({"reason": r}, n) for r, n in self.retries.items()],
+                ),
+                *format_metric(
+                    f"{prefix}_wire_bytes_total",
+                    "counter",
+                    "Bytes on the UART link.",
+                    [({"direction": "tx"}, self.bytes_tx)]
+                    + [({"direction": "rx"}, self.bytes_rx)],
+                ),
+                *format_metric(
+                    f"{prefix}_rows_total",
+                    "counter",
+                    "Rows sent per length mode.",
+                    [({"mode": m}, n) for m, n in enumerate(self.rows_by_mode) if n],
+                ),
+                *format_metric(
+                    f"{prefix}_lanes_total",
+                    "counter",
+                    "Lanes sent, split into scores and padding.",
+                    [({"kind": "used"}, self.lanes_used)]
+                    + [({"kind": "padding"}, self.lanes_sent - self.lanes_used)],
+                ),
+            ]
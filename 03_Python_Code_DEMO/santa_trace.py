@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+# Opt-in Chrome / Perfetto trace of the approximate models. The attention
+# modules open spans per layer and per phase; the UART driver reports its
+# stages through the same hooks as SantaStats, so a Tracer can be passed
+# wherever stats= is accepted. Open the saved JSON in chrome://tracing or
+# ui.perfetto.dev.
+#
+#   with tracing(approx_model, "trace.json"):
+#       approx_model(**inputs)
+
+DRIVER_SPANS = {
+    "pack": "host packing",
+    "decode": "host unpacking",
+    "dispatch": "softmax dispatch",
+}
+
+
+class Tracer:
+
+    def __init__(self):
+        self.events: list[dict] = []
+        self._lock = threading.Lock()
+        self._threads: set[int] = set()
+        self._t0 = time.perf_counter()
+        self._pid = os.getpid()
+
+    def _ts(self, t: float) -> float:
+        return (t - self._t0) * 1e6
+
+    def _add(self, event: dict) -> None:
+        tid = threading.get_ident()
+        event["pid"] = self._pid
+        event["tid"] = tid
+        with self._lock:
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": self._pid,
+                        "tid": tid,
+                        "args": {"name": threading.current_thread().name},
+                    }
+                )
+            self.events.append(event)
+
+    def complete(self, name: str, start: float, dur: float, cat: str, **args):
+        # start is a time.perf_counter() value, dur in seconds
+        self._add(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": self._ts(start),
+                "dur": dur * 1e6,
+                "args": args,
+            }
+        )
+
+    @contextmanager
+    def span(self, name: str, cat: str = "model", **args):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, t0, time.perf_counter() - t0, cat, **args)
+
+    # SantaStats hooks
+
+    def observe(self, stage: str, seconds: float) -> None:
+        now = time.perf_counter()
+        self.complete(DRIVER_SPANS.get(stage, stage), now - seconds, seconds, "host")
+
+    @contextmanager
+    def timed(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def record_transaction(self, tx, send_s, wait_s, recv_s, total_s) -> None:
+        # Called right after the last reply byte, so the phases end "now".
+        end = time.perf_counter()
+        rows = int(tx.shape[0])
+        self.complete("transaction", end - total_s, total_s, "uart", rows=rows)
+        t = end - recv_s - wait_s - send_s
+        self.complete("UART TX", t, send_s, "uart", bytes=1 + int(tx.size))
+        self.complete("board compute", t + send_s, wait_s, "uart", rows=rows)
+        self.complete("UART RX", end - recv_s, recv_s, "uart", bytes=int(tx.size))
+
+    def record_retry(self, reason: str) -> None:
+        self._add(
+            {
+                "name": f"retry ({reason})",
+                "cat": "uart",
+                "ph": "i",
+                "s": "t",
+                "ts": self._ts(time.perf_counter()),
+            }
+        )
+
+    def record_lanes(self, used: int, sent: int) -> None:
+        pass
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f)
+
+
+class _Tee:
+    # Fans the driver's stats hooks out to several sinks.
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def observe(self, stage, seconds):
+        for s in self.sinks:
+            s.observe(stage, seconds)
+
+    @contextmanager
+    def timed(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def record_transaction(self, *args):
+        for s in self.sinks:
+            s.record_transaction(*args)
+
+    def record_retry(self, reason):
+        for s in self.sinks:
+            s.record_retry(reason)
+
+    def record_lanes(self, used, sent):
+        for s in self.sinks:
+            s.record_lanes(used, sent)
+
+
+def tee(*sinks):
+    # stats= argument that reports to every non-None sink (SantaStats, Tracer).
+    sinks = [s for s in sinks if s is not None]
+    if len(sinks) <= 1:
+        return sinks[0] if sinks else None
+    return _Tee(sinks)
+
+
+def span(tracer: Tracer | None, name: str, **args):
+    # No-op when tracing is off, so forward() does not branch on it.
+    if tracer is None:
+        return nullcontext()
+    return tracer.span(name, **args)
+
+
+def _layer_span(tracer: Tracer, module, name: str) -> list:
+    # One span per call of the module, named after its place in the model.
+    starts = {}
+
+    def pre(mod, args):
+        starts[threading.get_ident()] = time.perf_counter()
+
+    def post(mod, args, output):
+        t0 = starts.pop(threading.get_ident(), None)
+        if t0 is not None:
+            tracer.complete(name, t0, time.perf_counter() - t0, "model")
+
+    return [module.register_forward_pre_hook(pre), module.register_forward_hook(post)]
+
+
+@contextmanager
+def tracing(model, path: str | None = None, tracer: Tracer | None = None):
+    # Attach a tracer to every approximate attention module in model (and to
+    # the softmax backend they share, which passes it on to an
+    # AsyncSantaDevice), detach it on exit and write the trace to path.
+    tracer = tracer or Tracer()
+    attached = []
+    hooks = []
+    for name, module in model.named_modules():
+        if hasattr(module, "set_tracer"):
+            module.set_tracer(tracer)
+            hooks += _layer_span(tracer, module, name)
+            attached.append(module)
+            backend = getattr(module, "backend", None)
+            if backend is not None and backend not in attached:
+                backend.set_tracer(tracer)
+                attached.append(backend)
+    try:
+        with tracer.span(type(model).__name__, cat="model"):
+            yield tracer
+    finally:
+        for hook in hooks:
+            hook.remove()
+        for obj in attached:
+            obj.set_tracer(None)
+        if path is not None:
+            tracer.save(path)
@@ -1,6 +1,7 @@
 import serial
 import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 Q = 10
 SCALE = 1 << Q
@@ -9,8 +10,46 @@ I16_MIN, I16_MAX = -32768, 32767
 BYTES_PER_ROW = 129
 MAX_DEPTH = 127
 
+EMULATOR_PORT = "emulator"
+
+# Readiness probe: one 64x1 row of zeros, whose softmax is 1/64 on every lane.
+# Filler bytes used for resync are zeros, i.e. depth-0 16x4 rows that answer
+# with 1/16, so a filler reply is never mistaken for the probe reply.
+PROBE_MODE = 2
+PROBE_REPLY_Q610 = SCALE // 64
+TX_BYTES = 1 + BYTES_PER_ROW
+
+# Per-transaction timeout = TIMEOUT_SLACK x (wire time of the request and the
+# reply + core time per row for its length mode) + TIMEOUT_FLOOR_S, capped by
+# the caller's timeout_s. CORE_LATENCY_S is per row, indexed by header nibble;
+# calibrate_core_latency() measures it on one board and keeps the result on
+# that port (ser.core_latency_s), so boards of a pool time out independently.
+CORE_LATENCY_S = np.full((16,), 20e-6)
+TIMEOUT_SLACK = 3.0
+TIMEOUT_FLOOR_S = 0.05
+TX_RETRIES = 2
+
+# Reply sanity check: every probability in a reply lies in [0, 1.0] and each
+# softmax sums to roughly 1.0 in Q6.10. Forwarding modes lose more to
+# truncation, so their lower bound is looser. Softmaxes where x - max wraps in
+# the 16-bit datapath (spread of 32.0 or more with a large max) do not
+# normalise and are not checked.
+SUM_BOUNDS_DIRECT = (0.875, 1.25)
+SUM_BOUNDS_FORWARDING = (0.25, 1.5)
+
+
+class SantaReplyError(RuntimeError):
+    pass
+
+
+def open_serial(
+    port: str, baud: int = 115200, timeout: float = 1.0, ready_timeout_s: float = 3.0
+) -> serial.Serial:
+    if port == EMULATOR_PORT:
+        from softmax_emulator import EmulatedSerial
+
+        return EmulatedSerial(port)
 
-def open_serial(port: str, baud: int = 115200, timeout: float = 1.0) -> serial.Serial:
     ser = serial.Serial(
         port=port,
         baudrate=baud,
@@ -23,9 +62,9 @@ def open_serial(port: str, baud: int = 115200, timeout: float = 1.0) -> serial.S
         rtscts=False,
         dsrdtr=False,
     )
-    time.sleep(2.0)
     ser.reset_input_buffer()
     ser.reset_output_buffer()
+    wait_ready(ser, timeout_s=ready_timeout_s)
     return ser
 
 
@@ -34,7 +73,9 @@ def close_serial(ser: serial.Serial) -> None:
         ser.close()
 
 
-def send_frame(ser: serial.Serial, depth: int, frames: list[bytes]) -> None:
+def send_frame(
+    ser: serial.Serial, depth: int, frames: list[bytes] | np.ndarray
+) -> None:
     if not ser.is_open:
         raise ConnectionError("Serial port is not open.")
     if not (0 <= depth <= MAX_DEPTH):
@@ -44,31 +85,62 @@ def send_frame(ser: serial.Serial, depth: int, frames: list[bytes]) -> None:
     if len(frames) != n_rows:
         raise ValueError(f"frames length must be depth+1={n_rows}, got {len(frames)}")
 
-    for i, fr in enumerate(frames):
-        if not isinstance(fr, (bytes, bytearray)):
-            raise TypeError(f"frames[{i}] must be bytes-like, got {type(fr)}")
-        if len(fr) != BYTES_PER_ROW:
+    if isinstance(frames, np.ndarray):
+        if frames.dtype != np.uint8 or frames.shape != (n_rows, BYTES_PER_ROW):
             raise ValueError(
-                f"frames[{i}] must be {BYTES_PER_ROW} bytes, got {len(fr)}"
+                f"frames must be uint8 of shape ({n_rows}, {BYTES_PER_ROW}), "
+                f"got {frames.dtype} {frames.shape}"
             )
-    ser.reset_input_buffer()
+        payload = frames.reshape(-1)
+    else:
+        for i, fr in enumerate(frames):
+            if not isinstance(fr, (bytes, bytearray)):
+                raise TypeError(f"frames[{i}] must be bytes-like, got {type(fr)}")
+            if len(fr) != BYTES_PER_ROW:
+                raise ValueError(
+                    f"frames[{i}] must be {BYTES_PER_ROW} bytes, got {len(fr)}"
+                )
+        payload = np.frombuffer(b"".join(frames), dtype=np.uint8)
+
+    tx = np.empty((1 + n_rows * BYTES_PER_ROW,), dtype=np.uint8)
+    tx[0] = depth
+    tx[1:] = payload
 
-    ser.write(bytes([depth]))
-    ser.flush()
-    for fr in frames:
-        ser.write(fr)
+    ser.reset_input_buffer()
+    ser.write(tx.data)
     ser.flush()
 
 
+def read_exact_into(
+    ser: serial.Serial, buf, *, timeout_s: float = 5.0, deadline: float | None = None
+) -> int:
+    # Each read is bounded by the time left (the port timeout is lowered for
+    # it and restored after), so a short timeout_s fires on time even with a
+    # long port timeout. deadline (time.monotonic()) overrides timeout_s.
+    mv = memoryview(buf).cast("B")
+    n = len(mv)
+    got = 0
+    if deadline is None:
+        deadline = time.monotonic() + timeout_s
+    has_timeout = hasattr(ser, "timeout")
+    port_timeout = ser.timeout if has_timeout else None
+    try:
+        while got < n:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise TimeoutError(f"read_exact timeout: got {got}/{n} bytes")
+            if has_timeout and (port_timeout is None or left < port_timeout):
+                ser.timeout = left
+            got += ser.readinto(mv[got:]) or 0
+    finally:
+        if has_timeout and ser.timeout != port_timeout:
+            ser.timeout = port_timeout
+    return got
+
+
 def read_exact(ser: serial.Serial, n: int, *, timeout_s: float = 5.0) -> bytes:
-    buf = bytearray()
-    t0 = time.time()
-    while len(buf) < n:
-        if (time.time() - t0) > timeout_s:
-            raise TimeoutError(f"read_exact timeout: got {len(buf)}/{n} bytes")
-        chunk = ser.read(n - len(buf))
-        if chunk:
-            buf.extend(chunk)
+    buf = bytearray(n)
+    read_exact_into(ser, buf, timeout_s=timeout_s)
     return bytes(buf)
 
 
@@ -84,6 +156,128 @@ def recv_frames(
     return [rx[i * BYTES_PER_ROW : (i + 1) * BYTES_PER_ROW] for i in range(n_rows)]
 
 
+def recv_frames_into(
+    ser: serial.Serial, depth: int, out: np.ndarray, *, timeout_s: float = 10.0
+) -> np.ndarray:
+    if not (0 <= depth <= MAX_DEPTH):
+        raise ValueError(f"depth must be 0..{MAX_DEPTH}")
+
+    n_rows = depth + 1
+    if out.shape != (n_rows, BYTES_PER_ROW):
+        raise ValueError(f"out must have shape ({n_rows}, {BYTES_PER_ROW})")
+    if not out.flags.c_contiguous:
+        raise ValueError("out must be C-contiguous")
+    read_exact_into(ser, out, timeout_s=timeout_s)
+    return out
+
+
+def _line_time(ser: serial.Serial, n_bytes: int) -> float:
+    baud = getattr(ser, "baudrate", None) or 115200
+    return n_bytes * 10 / baud
+
+
+def _read_available(ser: serial.Serial, n: int, timeout_s: float) -> bytes:
+    # Polls in_waiting so the wait is bounded by timeout_s, not the port timeout.
+    buf = bytearray()
+    deadline = time.monotonic() + timeout_s
+    while len(buf) < n and time.monotonic() <= deadline:
+        k = min(ser.in_waiting, n - len(buf))
+        if k:
+            buf += ser.read(k)
+        else:
+            time.sleep(0.0005)
+    return bytes(buf)
+
+
+def drain_input(ser: serial.Serial, quiet_s: float = 0.005) -> int:
+    # Read until the line has been quiet for quiet_s; returns bytes dropped.
+    dropped = 0
+    quiet_until = time.monotonic() + quiet_s
+    while time.monotonic() < quiet_until:
+        n = ser.in_waiting
+        if n:
+            dropped += len(ser.read(n))
+            quiet_until = time.monotonic() + quiet_s
+    ser.reset_input_buffer()
+    return dropped
+
+
+def probe_ready(ser: serial.Serial, timeout_s: float | None = None) -> bool:
+    if timeout_s is None:
+        timeout_s = 3 * _line_time(ser, 2 * TX_BYTES) + 0.02
+    frame = np.zeros((1, BYTES_PER_ROW), dtype=np.uint8)
+    frame[0, 0] = PROBE_MODE
+    send_frame(ser, 0, frame)
+    rx = _read_available(ser, BYTES_PER_ROW, timeout_s)
+    if len(rx) != BYTES_PER_ROW or rx[0] != 0:
+        return False
+    return bool(np.all(np.frombuffer(rx[1:], dtype=">i2") == PROBE_REPLY_Q610))
+
+
+def resync(ser: serial.Serial) -> None:
+    # Bring the uart_bram_controller back to its idle state without reopening
+    # the port. Zero bytes first finish whatever transaction the board is
+    # stuck in; after that it only sees depth-0 rows of 130 bytes, and the
+    # unknown fill level p of the last one is found by binary search (a reply
+    # comes back iff the bytes sent complete it).
+    ser.reset_output_buffer()
+    drain_input(ser)
+    if probe_ready(ser):
+        return
+
+    # The controller's depth register is 8 bits, so a misaligned byte can
+    # leave it waiting for up to 256 rows even though we never send > 128.
+    wait_s = 3 * _line_time(ser, 2 * TX_BYTES) + 0.02
+    chunk = bytes(10 * TX_BYTES)
+    budget = 1 + 256 * BYTES_PER_ROW + TX_BYTES
+    sent = 0
+    drain_input(ser)
+    while True:
+        ser.write(chunk)
+        ser.flush()
+        sent += len(chunk)
+        if _read_available(ser, 1, wait_s):
+            break
+        if sent >= budget:
+            raise ConnectionError("SANTA board does not respond to resync")
+    drain_input(ser, quiet_s=wait_s)
+
+    lo, hi = 0, TX_BYTES - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        ser.write(bytes(TX_BYTES - mid))
+        ser.flush()
+        if _read_available(ser, BYTES_PER_ROW, wait_s):
+            drain_input(ser)
+            lo, hi = max(lo, mid) - mid, hi - mid
+        else:
+            lo, hi = lo + TX_BYTES - mid, TX_BYTES - 1
+    if lo:
+        ser.write(bytes(TX_BYTES - lo))
+        ser.flush()
+        _read_available(ser, BYTES_PER_ROW, wait_s)
+        drain_input(ser)
+
+    if not probe_ready(ser):
+        raise ConnectionError("SANTA board did not answer the probe after resync")
+
+
+def wait_ready(ser: serial.Serial, timeout_s: float = 3.0) -> float:
+    # Returns as soon as the board answers the probe correctly.
+    t0 = time.monotonic()
+    deadline = t0 + timeout_s
+    while True:
+        try:
+            resync(ser)
+            return time.monotonic() - t0
+        except (ConnectionError, serial.SerialException) as e:
+            if time.monotonic() >= deadline:
+                raise ConnectionError(
+                    f"SANTA board not ready after {timeout_s:.1f}s: {e}"
+                ) from e
+            time.sleep(0.05)
+
+
 def pack_params(token_len: int) -> tuple[int, int]:
     if not (1 <= token_len <= 64):
         raise ValueError("Length must be between 1 and 64 for pack_params().")
@@ -160,6 +354,181 @@ def split_depths(
     return depths
 
 
+def length_modes(token_lens: np.ndarray) -> np.ndarray:
+    L = np.asarray(token_lens, dtype=np.int64)
+    if L.size and (L.min() < 1 or L.max() > 768):
+        raise ValueError("Length must be between 1 and 768.")
+    return np.where(
+        L <= 16, 0, np.where(L <= 32, 1, np.where(L <= 64, 2, (L + 63) // 64 + 1))
+    )
+
+
+def mode_capacity(len_mode: int) -> int:
+    if len_mode <= 2:
+        return 16 << len_mode
+    return 64 * (len_mode - 1)
+
+
+def plan_transactions(
+    unit_sizes: np.ndarray, max_rows_per_tx: int = 128
+) -> tuple[np.ndarray, list[int]]:
+    # Units are runs of consecutive frames that must share a transaction
+    # (a forwarding group, or a single frame). Groups are placed first-fit
+    # decreasing, then single frames fill the gaps and the remaining rows.
+    sizes = np.asarray(unit_sizes, dtype=np.int64)
+    if sizes.size and sizes.max() > max_rows_per_tx:
+        raise ValueError(f"group({sizes.max()}) > max_rows_per_tx({max_rows_per_tx})")
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    bins: list[list[np.ndarray]] = []
+    used: list[int] = []
+    for g in sorted(set(sizes[sizes > 1].tolist()), reverse=True):
+        todo = starts[sizes == g]
+        for b in range(len(bins)):
+            k = min((max_rows_per_tx - used[b]) // g, len(todo))
+            if k:
+                bins[b].append((todo[:k, None] + np.arange(g)).reshape(-1))
+                used[b] += k * g
+                todo = todo[k:]
+        per_bin = max_rows_per_tx // g
+        for off in range(0, len(todo), per_bin):
+            part = todo[off : off + per_bin]
+            bins.append([(part[:, None] + np.arange(g)).reshape(-1)])
+            used.append(len(part) * g)
+
+    singles = starts[sizes == 1]
+    for b in range(len(bins)):
+        k = max_rows_per_tx - used[b]
+        if k and len(singles):
+            bins[b].append(singles[:k])
+            used[b] += len(singles[:k])
+            singles = singles[k:]
+    for off in range(0, len(singles), max_rows_per_tx):
+        part = singles[off : off + max_rows_per_tx]
+        bins.append([part])
+        used.append(len(part))
+
+    order = np.concatenate([np.concatenate(b) for b in bins]) if bins else starts
+    return order, [n - 1 for n in used]
+
+
+def quantize_q610(scores: np.ndarray, out: np.ndarray) -> np.ndarray:
+    x = np.asarray(scores, dtype=np.float32)
+    with np.errstate(over="ignore"):
+        scaled = np.multiply(x, np.float32(SCALE))
+    np.nan_to_num(scaled, copy=False, nan=0.0)
+    np.clip(scaled, I16_MIN, I16_MAX, out=scaled)
+    np.rint(scaled, out=scaled)
+    np.copyto(out, scaled, casting="unsafe")
+    return out
+
+
+def frame_count(n_seqs: int, token_len: int) -> int:
+    len_mode = length_mode(token_len)
+    if len_mode in (0, 1, 2):
+        _, pack = pack_params(token_len)
+        return (n_seqs + pack - 1) // pack
+    return n_seqs * ((token_len + 63) // 64)
+
+
+def pack_frames(
+    scores: np.ndarray, pad_value: float = -32.0, out: np.ndarray | None = None
+) -> tuple[np.ndarray, int]:
+    x = np.asarray(scores, dtype=np.float32)
+    if x.ndim != 2:
+        raise ValueError(f"scores must be 2D (N, L), got shape {x.shape}")
+    N, L = x.shape
+    len_mode = length_mode(L)
+    total_rows = frame_count(N, L)
+
+    if out is None:
+        out = np.empty((total_rows, BYTES_PER_ROW), dtype=np.uint8)
+    elif (
+        out.dtype != np.uint8
+        or out.shape[0] < total_rows
+        or out.shape[1:] != (BYTES_PER_ROW,)
+    ):
+        raise ValueError(
+            f"out must be uint8 of shape (>={total_rows}, {BYTES_PER_ROW})"
+        )
+    frames = out[:total_rows]
+
+    pad_q = quantize_q610(np.full((1,), pad_value), np.empty((1,), dtype=np.int16))[0]
+    frames[:, 0] = len_mode & 0x0F
+    payload = frames[:, 1:].view(">i2")
+    payload[...] = pad_q
+
+    if len_mode in (0, 1, 2):
+        block_size, pack = pack_params(L)
+        blocks = payload.reshape(total_rows, pack, block_size)
+        n_full = N // pack
+        quantize_q610(
+            x[: n_full * pack].reshape(n_full, pack, L), blocks[:n_full, :, :L]
+        )
+        if N > n_full * pack:
+            quantize_q610(x[n_full * pack :], blocks[n_full, : N - n_full * pack, :L])
+    else:
+        rows_per_softmax = (L + 63) // 64
+        chunks = payload.reshape(N, rows_per_softmax, 64)
+        n_full = L // 64
+        quantize_q610(x[:, : n_full * 64].reshape(N, n_full, 64), chunks[:, :n_full, :])
+        if L > n_full * 64:
+            quantize_q610(x[:, n_full * 64 :], chunks[:, n_full, : L - n_full * 64])
+
+    return frames, len_mode
+
+
+def unpack_frames(frames: np.ndarray, out: np.ndarray) -> np.ndarray:
+    N, L = out.shape
+    total_rows = frame_count(N, L)
+    if frames.shape != (total_rows, BYTES_PER_ROW):
+        raise RuntimeError(
+            f"RX rows mismatch: got {frames.shape[0]}, expected {total_rows}"
+        )
+    return unpack_lanes(frames[:, 1:].view(">i2"), out, 1.0 / SCALE)
+
+
+def unpack_lanes(payload: np.ndarray, out: np.ndarray, scale: float) -> np.ndarray:
+    # payload: (frames, 64) lanes of the reply, in any dtype; out[i] gets
+    # softmax i of the frames times scale.
+    N, L = out.shape
+    len_mode = length_mode(L)
+    total_rows = payload.shape[0]
+
+    if len_mode in (0, 1, 2):
+        block_size, pack = pack_params(L)
+        blocks = payload.reshape(total_rows, pack, block_size)
+        n_full = N // pack
+        np.multiply(
+            blocks[:n_full, :, :L],
+            scale,
+            out=out[: n_full * pack].reshape(n_full, pack, L),
+        )
+        if N > n_full * pack:
+            np.multiply(
+                blocks[n_full, : N - n_full * pack, :L],
+                scale,
+                out=out[n_full * pack :],
+            )
+    else:
+        rows_per_softmax = (L + 63) // 64
+        chunks = payload.reshape(N, rows_per_softmax, 64)
+        n_full = L // 64
+        np.multiply(
+            chunks[:, :n_full, :],
+            scale,
+            out=out[:, : n_full * 64].reshape(N, n_full, 64),
+        )
+        if L > n_full * 64:
+            np.multiply(
+                chunks[:, n_full, : L - n_full * 64],
+                scale,
+                out=out[:, n_full * 64 :],
+            )
+
+    return out
+
+
 def floats64_to_row_bytes(payload64_f32: np.ndarray, *, header_mode: int) -> bytes:
     x = np.asarray(payload64_f32, dtype=np.float64)
     if x.shape != (64,):
@@ -185,100 +554,451 @@ def row_bytes_to_floats64(row129: bytes) -> np.ndarray:
     return i16.astype(np.float64) / SCALE
 
 
-def softmax_batch(
+def transaction_chunks(
+    n_seqs: int, token_len: int, depth_list: list[int]
+) -> list[tuple[int, int, int, int]]:
+    len_mode = length_mode(token_len)
+    if len_mode in (0, 1, 2):
+        _, seqs_per_row = pack_params(token_len)
+        rows_per_seq = 1
+    else:
+        seqs_per_row = 1
+        rows_per_seq = (token_len + 63) // 64
+
+    chunks: list[tuple[int, int, int, int]] = []
+    r0 = 0
+    for depth in depth_list:
+        r1 = r0 + depth + 1
+        s0 = r0 * seqs_per_row // rows_per_seq
+        s1 = min(r1 * seqs_per_row // rows_per_seq, n_seqs)
+        chunks.append((r0, r1, s0, s1))
+        r0 = r1
+    return chunks
+
+
+def expected_transaction_time(ser: serial.Serial, tx: np.ndarray) -> float:
+    n_rows = tx.shape[0]
+    wire = _line_time(ser, 1 + 2 * n_rows * BYTES_PER_ROW)
+    latency = getattr(ser, "core_latency_s", CORE_LATENCY_S)
+    core = float(latency[tx[:, 0] & 0x0F].sum())
+    return wire + core
+
+
+def transaction_timeout(
+    ser: serial.Serial, tx: np.ndarray, timeout_s: float | None = None
+) -> float:
+    t = TIMEOUT_SLACK * expected_transaction_time(ser, tx) + TIMEOUT_FLOOR_S
+    return t if timeout_s is None else min(t, timeout_s)
+
+
+def calibrate_core_latency(
+    ser: serial.Serial, modes=range(14), repeats: int = 3
+) -> np.ndarray:
+    # Times a full transaction of zero rows per mode and keeps what the wire
+    # time does not explain, per row, on the port.
+    latency = np.array(getattr(ser, "core_latency_s", CORE_LATENCY_S))
+    for m in modes:
+        group = m - 1 if 3 <= m <= 13 else 1
+        n_rows = (MAX_DEPTH + 1) // group * group
+        tx = np.zeros((n_rows, BYTES_PER_ROW), dtype=np.uint8)
+        tx[:, 0] = m
+        rx = np.empty_like(tx)
+        best = float("inf")
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            send_frame(ser, n_rows - 1, tx)
+            recv_frames_into(ser, n_rows - 1, rx, timeout_s=10.0)
+            best = min(best, time.perf_counter() - t0)
+        wire = _line_time(ser, 1 + 2 * n_rows * BYTES_PER_ROW)
+        latency[m] = max(best - wire, 0.0) / n_rows
+    ser.core_latency_s = latency
+    return latency
+
+
+def check_reply(tx: np.ndarray, rx: np.ndarray) -> str | None:
+    # Returns why the reply looks corrupted, or None if it passes.
+    if rx.shape != tx.shape:
+        return f"expected {tx.shape[0]} rows, got {rx.shape[0]}"
+    bad = np.flatnonzero(rx[:, 0])
+    if len(bad):
+        return f"row {bad[0]} has header 0x{rx[bad[0], 0]:02X}, expected 0x00"
+
+    modes = tx[:, 0] & 0x0F
+    x = tx[:, 1:].view(">i2")
+    y = rx[:, 1:].view(">i2")
+    for m in np.unique(modes).tolist():
+        rows = np.flatnonzero(modes == m)
+        if 3 <= m <= 13:
+            width, (lo, hi) = 64 * (m - 1), SUM_BOUNDS_FORWARDING
+            if len(rows) % (m - 1):
+                return f"mode {m} rows are not whole groups"
+        else:
+            width, (lo, hi) = 16 << min(m, 2), SUM_BOUNDS_DIRECT
+        xs = x[rows].astype(np.int32).reshape(-1, width)
+        ps = y[rows].astype(np.int32).reshape(-1, width)
+        diff = ((xs - xs.max(axis=1, keepdims=True) + 0x8000) & 0xFFFF) - 0x8000
+        y1 = ((((diff * 0x5C4) >> 10) + 0x8000) & 0xFFFF) - 0x8000
+        checked = (y1 <= 0).all(axis=1)
+        out_of_range = ((ps < 0) | (ps > SCALE)).any(axis=1)
+        sums = ps.sum(axis=1) / SCALE
+        off = np.flatnonzero(checked & out_of_range)
+        if len(off):
+            return f"mode {m} softmax has a probability outside [0, 1]"
+        off = np.flatnonzero(checked & ((sums < lo) | (sums > hi)))
+        if len(off):
+            return f"mode {m} softmax sums to {sums[off[0]]:.3f}"
+    return None
+
+
+def _transact(
     ser: serial.Serial,
-    scores_list: list[np.ndarray],
+    tx: np.ndarray,
+    rx: np.ndarray,
+    timeout_s: float,
+    retries: int = TX_RETRIES,
+    stats=None,
+) -> None:
+    # A lost or flipped byte only costs this transaction a few expected round
+    # trips: time out early or reject the reply, resync the controller and
+    # resend just this one. A reply that fails the check twice with the same
+    # bytes is what the core computes for that input and is accepted.
+    depth = tx.shape[0] - 1
+    limit = transaction_timeout(ser, tx, timeout_s)
+    last_bad = None
+    t_start = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            if stats is None:
+                send_frame(ser, depth, tx)
+                recv_frames_into(ser, depth, rx, timeout_s=limit)
+            else:
+                # Reading the first byte on its own splits the round trip
+                # into waiting for the core and draining the reply.
+                t0 = time.perf_counter()
+                send_frame(ser, depth, tx)
+                t1 = time.perf_counter()
+                flat = rx.reshape(-1)
+                deadline = time.monotonic() + limit
+                read_exact_into(ser, flat[:1], deadline=deadline)
+                t2 = time.perf_counter()
+                read_exact_into(ser, flat[1:], deadline=deadline)
+                t3 = time.perf_counter()
+        except TimeoutError:
+            if attempt == retries:
+                raise
+            if stats is not None:
+                stats.record_retry("timeout")
+            resync(ser)
+            continue
+        problem = check_reply(tx, rx)
+        if problem is None or (last_bad is not None and np.array_equal(rx, last_bad)):
+            if stats is not None:
+                stats.record_transaction(tx, t1 - t0, t2 - t1, t3 - t2, t3 - t_start)
+            return
+        if attempt == retries:
+            raise SantaReplyError(f"Corrupted reply after {retries} retries: {problem}")
+        if stats is not None:
+            stats.record_retry("corrupt")
+        last_bad = rx.copy()
+        resync(ser)
+
+
+def run_transactions(
+    ser: serial.Serial,
+    tx: np.ndarray,
+    rx: np.ndarray,
+    depth_list: list[int],
+    timeout_s: float,
+    stats=None,
+) -> None:
+    # A device pool (anything with run_transactions) shards the list itself;
+    # a plain port runs the transactions back to back.
+    if hasattr(ser, "run_transactions"):
+        ser.run_transactions(tx, rx, depth_list, timeout_s, stats=stats)
+        return
+    r0 = 0
+    for depth in depth_list:
+        r1 = r0 + depth + 1
+        _transact(ser, tx[r0:r1], rx[r0:r1], timeout_s, stats=stats)
+        r0 = r1
+
+
+def run_pipelined(
+    ser: serial.Serial,
+    tx: np.ndarray,
+    rx: np.ndarray,
+    depth_list: list[int],
+    timeout_s: float,
+    pack,
+    unpack,
+    stats=None,
+) -> None:
+    # The I/O thread owns the port and runs transactions in submission order
+    # while this thread packs the next one (pack(r0, r1) fills tx[r0:r1]) and
+    # decodes the previous one (unpack(r0, r1) reads rx[r0:r1]).
+    io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="santa-uart")
+    try:
+        in_flight = None
+        r0 = 0
+        for depth in depth_list:
+            r1 = r0 + depth + 1
+            pack(r0, r1)
+            fut = io.submit(
+                _transact, ser, tx[r0:r1], rx[r0:r1], timeout_s, stats=stats
+            )
+            if in_flight is not None:
+                prev, p0, p1 = in_flight
+                prev.result()
+                unpack(p0, p1)
+            in_flight = fut, r0, r1
+            r0 = r1
+        prev, p0, p1 = in_flight
+        prev.result()
+        unpack(p0, p1)
+    finally:
+        io.shutdown(wait=True, cancel_futures=True)
+
+
+def HW_softmax_2d(
+    ser: serial.Serial,
+    scores: np.ndarray,
     pad_value: float = -32.0,
     timeout_s: float = 10.0,
-) -> list[np.ndarray]:
-    if not scores_list:
-        return []
-
-    seqs = [np.asarray(s, dtype=np.float32).reshape(-1) for s in scores_list]
-    L = int(seqs[0].shape[0])
+    out: np.ndarray | None = None,
+    pipelined: bool = False,
+    cache=None,
+    stats=None,
+) -> np.ndarray:
+    x = np.asarray(scores, dtype=np.float32)
+    if x.ndim != 2:
+        raise ValueError(f"scores must be 2D (N, L), got shape {x.shape}")
+    N, L = x.shape
     if not (1 <= L <= 768):
         raise ValueError("Length must be between 1 and 768.")
-    if any(int(s.shape[0]) != L for s in seqs):
-        raise ValueError(f"All sequences must have the same length {L}.")
-
-    len_mode = length_mode(L)
-
-    frame_list: list[np.ndarray] = []
-
-    if len_mode in (0, 1, 2):
-        block_size, pack = pack_params(L)
-
-        for off in range(0, len(seqs), pack):
-            chunk = seqs[off : off + pack]
-            payload64 = np.full((64,), pad_value, dtype=np.float32)
-
-            for g, vec in enumerate(chunk):
-                mini = np.full((block_size,), pad_value, dtype=np.float32)
-                mini[:L] = vec
-                start = g * block_size
-                payload64[start : start + block_size] = mini
 
-            frame_list.append(payload64)
+    if out is None:
+        out = np.empty((N, L), dtype=np.float32)
+    elif out.shape != (N, L) or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a C-contiguous array of shape {(N, L)}")
+    if N == 0:
+        return out
+    if cache is not None:
+        return HW_softmax_varlen(
+            ser,
+            x,
+            np.full((N,), L),
+            pad_value=pad_value,
+            timeout_s=timeout_s,
+            out=out,
+            cache=cache,
+            stats=stats,
+            pipelined=pipelined,
+        )
 
-    else:
-        for vec in seqs:
-            for s in range(0, L, 64):
-                payload64 = np.full((64,), pad_value, dtype=np.float32)
-                chunk = vec[s : s + 64]
-                payload64[: chunk.shape[0]] = chunk
-                frame_list.append(payload64)
-
-    frame_bytes_list = [
-        floats64_to_row_bytes(p, header_mode=len_mode) for p in frame_list
-    ]
-
-    total_rows = len(frame_bytes_list)
+    len_mode = length_mode(L)
+    total_rows = frame_count(N, L)
     depth_list = split_depths(total_rows, len_mode, max_rows_per_tx=128)
+    chunks = transaction_chunks(N, L, depth_list)
 
-    result_rows: list[bytes] = []
-    cursor = 0
-    for depth in depth_list:
-        n_rows = depth + 1
-        frames_to_send = frame_bytes_list[cursor : cursor + n_rows]
-        cursor += n_rows
+    tx = np.empty((total_rows, BYTES_PER_ROW), dtype=np.uint8)
+    rx = np.empty_like(tx)
+    if stats is not None:
+        stats.record_lanes(N * L, total_rows * 64)
 
-        send_frame(ser, depth, frames_to_send)
-        recv_rows = recv_frames(ser, depth, timeout_s=timeout_s)
-        result_rows.extend(recv_rows)
+    if hasattr(ser, "run_transactions"):
+        pack_frames(x, pad_value=pad_value, out=tx)
+        ser.run_transactions(tx, rx, depth_list, timeout_s, stats=stats)
+        unpack_frames(rx, out)
+        return out
 
-    if len(result_rows) != total_rows:
-        raise RuntimeError(
-            f"RX rows mismatch: got {len(result_rows)}, expected {total_rows}"
-        )
+    if not pipelined or len(chunks) == 1:
+        for r0, r1, s0, s1 in chunks:
+            pack_frames(x[s0:s1], pad_value=pad_value, out=tx[r0:r1])
+            _transact(ser, tx[r0:r1], rx[r0:r1], timeout_s, stats=stats)
+            unpack_frames(rx[r0:r1], out[s0:s1])
+        return out
 
-    rx_payloads64 = [row_bytes_to_floats64(rb) for rb in result_rows]
+    seqs = {r0: (s0, s1) for r0, r1, s0, s1 in chunks}
 
-    results: list[np.ndarray] = []
+    def pack(r0, r1):
+        s0, s1 = seqs[r0]
+        pack_frames(x[s0:s1], pad_value=pad_value, out=tx[r0:r1])
 
-    if len_mode in (0, 1, 2):
-        block_size, pack = pack_params(L)
+    def unpack(r0, r1):
+        s0, s1 = seqs[r0]
+        unpack_frames(rx[r0:r1], out[s0:s1])
 
-        for row_idx, probs64 in enumerate(rx_payloads64):
-            off = row_idx * pack
-            if off >= len(seqs):
-                break
-            G = min(pack, len(seqs) - off)
+    run_pipelined(ser, tx, rx, depth_list, timeout_s, pack, unpack, stats=stats)
+    return out
 
-            for g in range(G):
-                start = g * block_size
-                results.append(np.asarray(probs64[start : start + L], dtype=np.float64))
 
+def HW_softmax_varlen(
+    ser: serial.Serial,
+    scores: np.ndarray,
+    lengths: np.ndarray,
+    pad_value: float = -32.0,
+    timeout_s: float = 10.0,
+    out: np.ndarray | None = None,
+    cache=None,
+    stats=None,
+    pipelined: bool = False,
+) -> np.ndarray:
+    x = np.asarray(scores, dtype=np.float32)
+    if x.ndim != 2:
+        raise ValueError(f"scores must be 2D (N, Lmax), got shape {x.shape}")
+    N, L_max = x.shape
+    lens = np.asarray(lengths, dtype=np.int64).reshape(-1)
+    if lens.shape != (N,):
+        raise ValueError(f"lengths must have shape ({N},), got {lens.shape}")
+    if N and lens.max() > L_max:
+        raise ValueError(f"lengths exceed the score width {L_max}")
+    modes = length_modes(lens)
+
+    if out is None:
+        out = np.zeros((N, L_max), dtype=np.float32)
+    elif out.shape != (N, L_max):
+        raise ValueError(f"out must have shape {(N, L_max)}")
     else:
-        rows_per_softmax = (L + 63) // 64
-        idx = 0
-        for _ in range(len(seqs)):
-            concat = np.concatenate(rx_payloads64[idx : idx + rows_per_softmax], axis=0)
-            results.append(concat[:L].astype(np.float64, copy=False))
-            idx += rows_per_softmax
+        out[...] = 0
+    if N == 0:
+        return out
+
+    # One bin per length mode; each row is padded to its mode's capacity so
+    # the bin packs exactly like a uniform-length HW_softmax_2d call. With a
+    # cache, only rows whose quantized payload has not been seen are sent.
+    t0 = time.perf_counter()
+    bins = []
+    frame_bufs = []
+    unit_sizes = []
+    for m in np.unique(modes).tolist():
+        idx = np.flatnonzero(modes == m)
+        cap = mode_capacity(m)
+        w = min(cap, L_max)
+        live = np.arange(w) < lens[idx, None]
+        xb = np.full((len(idx), cap), pad_value, dtype=np.float32)
+        xb[:, :w] = np.where(live, x[idx, :w], np.float32(pad_value))
+        probs = np.empty((len(idx), cap), dtype=np.float32)
+
+        send = np.arange(len(idx))
+        keys = None
+        if cache is not None:
+            q = quantize_q610(xb, np.empty(xb.shape, dtype=np.int16))
+            keys = [cache.key(row, m) for row in q]
+            first = {}
+            send = []
+            for i, k in enumerate(keys):
+                if k in first:
+                    continue
+                hit = cache.get(k)
+                if hit is None:
+                    first[k] = i
+                    send.append(i)
+                else:
+                    probs[i] = hit * np.float32(1.0 / SCALE)
+            send = np.asarray(send, dtype=np.int64)
+
+        if len(send):
+            frames, _ = pack_frames(xb[send], pad_value=pad_value)
+            group = 1 if m <= 2 else m - 1
+            frame_bufs.append(frames)
+            unit_sizes.append(np.full((len(frames) // group,), group))
+            n_frames = len(frames)
+            if stats is not None:
+                stats.record_lanes(int(lens[idx[send]].sum()), n_frames * 64)
+        else:
+            n_frames = 0
+        bins.append((idx, cap, w, live, probs, send, keys, n_frames))
+
+    if frame_bufs:
+        frames_all = np.concatenate(frame_bufs)
+        order, depth_list = plan_transactions(np.concatenate(unit_sizes))
+        tx = frames_all[order]
+        rx = np.empty_like(tx)
+        lanes = np.empty((len(tx), 64), dtype=np.float32)
+        if stats is not None:
+            stats.observe("pack", time.perf_counter() - t0)
+
+        def unpack(r0, r1):
+            # Back to frame order, as probabilities.
+            lanes[order[r0:r1]] = rx[r0:r1, 1:].view(">i2") * np.float32(1.0 / SCALE)
+
+        if pipelined and len(depth_list) > 1 and not hasattr(ser, "run_transactions"):
+            # Frames are packed up front; each reply is decoded while the
+            # next transaction is on the wire.
+            run_pipelined(
+                ser, tx, rx, depth_list, timeout_s, lambda r0, r1: None, unpack, stats
+            )
+        else:
+            run_transactions(ser, tx, rx, depth_list, timeout_s, stats=stats)
+            unpack(0, len(tx))
+    elif stats is not None:
+        stats.observe("pack", time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    r0 = 0
+    for idx, cap, w, live, probs, send, keys, n_frames in bins:
+        if n_frames:
+            probs[send] = unpack_lanes(
+                lanes[r0 : r0 + n_frames],
+                np.empty((len(send), cap), dtype=np.float32),
+                1.0,
+            )
+            r0 += n_frames
+        if keys is not None:
+            sent = {}
+            for i in send.tolist():
+                sent[keys[i]] = i
+                cache.put(keys[i], np.rint(probs[i] * SCALE).astype(np.int16))
+            for i, k in enumerate(keys):
+                j = sent.get(k)
+                if j is not None and j != i:
+                    probs[i] = probs[j]
+        out[idx, :w] = np.where(live, probs[:, :w], 0.0)
+    if stats is not None:
+        stats.observe("decode", time.perf_counter() - t0)
+
+    return out
 
-    if len(results) != len(seqs):
-        raise RuntimeError(
-            f"result count mismatch: got {len(results)}, expected {len(seqs)}"
-        )
 
-    return results
+def softmax_batch(
+    ser: serial.Serial,
+    scores_list: list[np.ndarray],
+    pad_value: float = -32.0,
+    timeout_s: float = 10.0,
+    cache=None,
+    stats=None,
+) -> list[np.ndarray]:
+    if not scores_list:
+        return []
+
+    seqs = [np.asarray(s, dtype=np.float32).reshape(-1) for s in scores_list]
+    L = int(seqs[0].shape[0])
+    if not all(1 <= s.shape[0] <= 768 for s in seqs):
+        raise ValueError("Length must be between 1 and 768.")
+    if any(int(s.shape[0]) != L for s in seqs):
+        lens = np.array([s.shape[0] for s in seqs], dtype=np.int64)
+        padded = np.zeros((len(seqs), int(lens.max())), dtype=np.float32)
+        for i, s in enumerate(seqs):
+            padded[i, : s.shape[0]] = s
+        out = HW_softmax_varlen(
+            ser,
+            padded,
+            lens,
+            pad_value=pad_value,
+            timeout_s=timeout_s,
+            cache=cache,
+            stats=stats,
+        )
+        return [out[i, :n].astype(np.float64) for i, n in enumerate(lens)]
+
+    out = np.empty((len(seqs), L), dtype=np.float64)
+    HW_softmax_2d(
+        ser,
+        np.stack(seqs),
+        pad_value=pad_value,
+        timeout_s=timeout_s,
+        out=out,
+        cache=cache,
+        stats=stats,
+    )
+    return list(out)
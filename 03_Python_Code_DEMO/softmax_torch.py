@@ -0,0 +1,76 @@
+import numpy as np
+import torch
+from softmax_batch import SCALE
+from softmax_emulator import LOG2E_Q10, _LOG2_INT_PART, _POW2_SHIFT
+
+# The SANTA approximate softmax on torch tensors, for accuracy studies
+# without the UART round trip. Same integer pipeline as SoftmaxApproxModel
+# (Q6.10 quantization, log2 / pow2 approximations, 16-bit wrapping
+# subtractors), on (..., Tk) scores in one shot. A row of length n is a
+# softmax over its mode's capacity (16, 32, 64 or 64 * ceil(n / 64) lanes)
+# with the lanes past n at pad_value, which is what HW_softmax_varlen sends,
+# so the result is bit-exact with the board. Works under torch.compile.
+#
+#   probs = softmax_approx(scores, lengths)             # (B, H, Tq, Tk)
+#   fast = torch.compile(softmax_approx, dynamic=True)
+
+_POW2_SHIFT_T = torch.from_numpy(_POW2_SHIFT.astype(np.int32))
+_LOG2_INT_PART_T = torch.from_numpy(_LOG2_INT_PART)
+_BITS = torch.tensor([1 << k for k in range(32)], dtype=torch.int64)
+
+
+def _wrap16(v: torch.Tensor) -> torch.Tensor:
+    return ((v + 0x8000) & 0xFFFF) - 0x8000
+
+
+def _pow2(y: torch.Tensor) -> torch.Tensor:
+    shift = _POW2_SHIFT_T.to(y.device)[(y >> 10) & 0x3F]
+    return (((y & 0x3FF) | 0x400) << 5) >> shift
+
+
+def _log2(u: torch.Tensor) -> torch.Tensor:
+    # Leading zeros by comparison, so there is no float round trip.
+    bit_len = (u.unsqueeze(-1) >= _BITS.to(u.device)).sum(dim=-1)
+    zero_cnt = torch.where(u == 0, 0, 32 - bit_len)
+    frac = ((u << zero_cnt) >> 21) & 0x3FF
+    return _wrap16(_LOG2_INT_PART_T.to(u.device)[zero_cnt] * SCALE + frac)
+
+
+def _capacity(n):
+    # Lanes the core reduces over for a row of length n (mode_capacity).
+    if isinstance(n, int):
+        return 16 if n <= 16 else 32 if n <= 32 else (n + 63) // 64 * 64
+    return torch.where(n <= 16, 16, torch.where(n <= 32, 32, (n + 63) // 64 * 64))
+
+
+def softmax_approx(
+    scores: torch.Tensor, lengths=None, pad_value: float = -32.0
+) -> torch.Tensor:
+    # scores (..., Tk); lengths broadcasts to scores.shape[:-1] (default Tk).
+    # Lanes past a row's length come back as 0.
+    Tk = scores.shape[-1]
+    if Tk > 768:
+        raise ValueError("Length must be between 1 and 768.")
+    W = _capacity(Tk)
+    device = scores.device
+    if lengths is None:
+        n = torch.full(scores.shape[:-1], Tk, dtype=torch.int64, device=device)
+    else:
+        n = torch.as_tensor(lengths, dtype=torch.int64, device=device)
+        n = n.expand(scores.shape[:-1])
+    n = n.unsqueeze(-1)
+    lane = torch.arange(W, device=device)
+
+    x = torch.nn.functional.pad(scores.to(torch.float32), (0, W - Tk))
+    x = torch.where(lane < n, x, pad_value) * SCALE
+    x = torch.nan_to_num(x, nan=0.0).clamp(-32768, 32767).round()
+    q = x.to(torch.int32)
+
+    in_cap = lane < _capacity(n)
+    m = torch.where(in_cap, q, -32768).amax(dim=-1, keepdim=True)
+    y = _wrap16((_wrap16(q - m) * LOG2E_Q10) >> 10)
+    s = torch.where(in_cap, _pow2(y), 0).sum(dim=-1, keepdim=True, dtype=torch.int64)
+    prob = _wrap16(_pow2(_wrap16(y - _log2(s).to(torch.int32))))
+
+    out = prob[..., :Tk].to(torch.float32) * (1.0 / SCALE)
+    return torch.where(lane[:Tk] < n, out, 0.0).to(scores.dtype)